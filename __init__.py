@@ -10,24 +10,54 @@ from ._constants import CONTENT_STATUS_UNPUBLISHED, CONTENT_STATUS_WAITING, CONT
     CONTENT_PERM_VIEW, CONTENT_PERM_VIEW_OWN, CONTENT_PERM_SET_LOCALIZATION, CONTENT_PERM_SET_PUBLISH_TIME, \
     CONTENT_PERM_BYPASS_MODERATION
 from ._api import register_model, get_models, find, get_model, get_model_title, dispense, is_model_registered, \
-    generate_rss, find_by_url, paginate, on_content_view
-from ._model import Content, ContentWithURL
+    generate_rss, find_by_url, paginate, on_content_view, on_content_published, as_jsonable_bulk, search, \
+    search_reindex, set_status, generate_feeds, get_model_schema, records, create_route_aliases
+from ._autocomplete import autocomplete
+from ._search import Engine as SearchEngine, register_engine as register_search_engine, \
+    get_engine as get_search_engine
+from ._model import Content, ContentWithURL, get_save_stats
+from ._jobs import Job, get_history as get_job_history
+from ._schema import Schema as ModelSchema
+from ._records import Record
+from ._async import find_async, paginate_async, gather_blocks, gather_blocks_async
+from ._ranking import get_top
+from ._render import render_image, render_images, render_video
+from ._feed import Writer as FeedWriter, register_writer as register_feed_writer, feed_item
 
 # Locally needed imports
 from semaver import Version as _Version
 
 
 def plugin_load():
-    from pytsite import router
+    import atexit
+    from pytsite import router, cache, events
     from plugins import permissions, admin
-    from . import _controllers
+    from . import _controllers, _eh, _metrics, _profiler, _ranking
 
     # Permissions group
     permissions.define_group('content', 'content@content')
 
+    # Metrics and profiling
+    _metrics.configure()
+    _profiler.configure()
+
+    # Cache pool for entities JSONable representations
+    cache.create_pool('content@jsonable')
+
+    # Cache pool for ranking lists
+    cache.create_pool('content@ranking')
+
+    # Ranking events aggregated in memory are written when the process exits
+    atexit.register(_ranking.flush_at_exit)
+
     # Admin section should exist before any content's models registration
     admin.sidebar.add_section('content', 'content@content', 100)
 
+    # Search index updates
+    events.listen('content@entity.save', _eh.on_content_entity_save)
+    events.listen('content@entity.delete', _eh.on_content_entity_delete)
+    events.listen('content@entities.set_status', _eh.on_content_entities_set_status)
+
     # Routes which must be registered in any environment
     router.handle(_controllers.View, 'content/view/<model>/<eid>', 'content@view')
 
@@ -37,6 +67,12 @@ def plugin_load_console():
     from . import _console_command
 
     console.register_command(_console_command.Generate())
+    console.register_command(_console_command.SearchReindex())
+    console.register_command(_console_command.ProfilerReport())
+    console.register_command(_console_command.Benchmark())
+    console.register_command(_console_command.Export())
+    console.register_command(_console_command.Import())
+    console.register_command(_console_command.Reindex())
 
 
 def plugin_load_wsgi():
@@ -47,18 +83,27 @@ def plugin_load_wsgi():
     # Events listeners
     cron.hourly(_eh.on_cron_hourly)
     cron.daily(_eh.on_cron_daily)
+    cron.every_min(_eh.on_cron_every_min)
     on_content_view(_eh.on_content_view)
+    on_content_published(_eh.on_content_entity_published)
     events.listen('comments@create_comment', _eh.on_comments_create_comment)
-    flag.on_flag_create(_eh.on_flag_toggle)
+    flag.on_flag_create(_eh.on_flag_create)
     flag.on_flag_delete(_eh.on_flag_toggle)
 
+    # Admin menu items of models registered by other plugins
+    router.on_dispatch(_eh.on_router_dispatch)
+
     # Routes
     router.handle(_controllers.Index, 'content/index/<model>', 'content@index')
+    router.handle(_controllers.Metrics, 'content/metrics', 'content@metrics')
+    router.handle(_controllers.SetStatus, 'content/set_status/<model>/<status>', 'content@set_status',
+                  methods='POST')
 
     # HTTP API endpoints
     http_api.handle('PATCH', 'content/view/<model>/<uid>', _http_api_controllers.PatchViewsCount,
                     'content@patch_view_count')
     http_api.handle('POST', 'content/abuse/<model>/<uid>', _http_api_controllers.PostAbuse, 'content@post_abuse')
+    http_api.handle('PATCH', 'content/status/<model>', _http_api_controllers.PatchStatus, 'content@patch_status')
 
     # Settings
     settings.define('content', _settings_form.Form, 'content@content', 'fa fa-glass', 'dev')
@@ -72,3 +117,16 @@ def plugin_update(v_from: _Version):
         from pytsite import mongodb
 
         mongodb.get_collection('content_model_entities').drop()
+
+    if v_from < '7.3':
+        from plugins import auth
+
+        # Fill title prefix keys of existing entities
+        try:
+            auth.switch_user_to_system()
+            for model in get_models():
+                for entity in find(model, language='*', status='*', check_publish_time=False).get():
+                    if entity.has_field('title_prefix_keys'):
+                        entity.f_set('title', entity.title).save(fast=True)
+        finally:
+            auth.restore_user()
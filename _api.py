@@ -4,18 +4,26 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from typing import Callable, Union, Tuple, Dict, Type, Optional
+import re
+from typing import Callable, Union, Tuple, Dict, Type, Optional, Iterable, Iterator, List
 from datetime import datetime
+from time import perf_counter
 from urllib import parse as _urllib_parse
 from os import path, makedirs
-from pytsite import util, router, lang, logger, reg, events
-from plugins import odm, route_alias, feed, admin, widget
+from bson import ObjectId
+from pymongo import UpdateOne
+from pytsite import util, router, lang, logger, reg, events, tpl, mail
+from plugins import odm, route_alias, admin, widget, auth
+from plugins.odm_auth import PERM_MODIFY, PERM_MODIFY_OWN
 from ._model import Content, ContentWithURL
-from ._constants import CONTENT_STATUS_PUBLISHED
+from ._constants import CONTENT_STATUS_PUBLISHED, CONTENT_STATUS_WAITING, CONTENT_STATUS_UNPUBLISHED, \
+    CONTENT_PERM_BYPASS_MODERATION
+from . import _search, _metrics, _profiler, _feed, _static, _schema, _records
 
 ContentModelClass = Type[Content]
 
 _models = {}  # type: Dict[str, Tuple[ContentModelClass, str]]
+_pending_admin_menus = {}  # type: Dict[str, dict]
 
 
 def register_model(model: str, cls: Union[str, ContentModelClass], title: str, menu_weight: int = 0,
@@ -38,20 +46,26 @@ def register_model(model: str, cls: Union[str, ContentModelClass], title: str, m
     # Saving info about registered _content_ model
     _models[model] = (cls, title)
 
+    # Schema is built on first use
+    _schema.remove(model)
+
+    # Admin menu is set up while dispatching the first request
     if reg.get('env.type') == 'wsgi':
-        mock = dispense(model)
-        perms = ['odm_auth@{}.{}'.format(p, model) for p in mock.odm_auth_permissions()],
+        _pending_admin_menus[model] = dict(sid=menu_sid, mid=model, title=title, icon=menu_icon, weight=menu_weight,
+                                           replace=replace)
+
+
+def setup_admin_menus():
+    """Add admin sidebar menu items of registered models
+    """
+    while _pending_admin_menus:
+        model, kwargs = _pending_admin_menus.popitem()
+        if not is_model_registered(model):
+            continue
 
-        admin.sidebar.add_menu(
-            sid=menu_sid,
-            mid=model,
-            title=title,
-            path=router.rule_path('odm_ui@admin_browse', {'model': model}),
-            icon=menu_icon,
-            weight=menu_weight,
-            permissions=perms,
-            replace=replace,
-        )
+        perms = ['odm_auth@{}.{}'.format(p, model) for p in _schema.get(model).permissions]
+        admin.sidebar.add_menu(path=router.rule_path('odm_ui@admin_browse', {'model': model}), permissions=perms,
+                               **kwargs)
 
 
 def is_model_registered(model: str) -> bool:
@@ -87,6 +101,24 @@ def get_model_title(model: str) -> str:
     return lang.t(get_model(model)[1])
 
 
+def records(finder: odm.SingleModelFinder, fields: Iterable[str], **kwargs) -> Iterator[_records.Record]:
+    """Iterate over compact read-only records of entities matched by a finder
+
+    Intended for bulk processing where neither hooks nor changes tracking are needed. `kwargs` are passed to
+    `_records.records()`: `sort`, `limit` and `batch_size`.
+    """
+    return _records.records(finder, fields, **kwargs)
+
+
+def get_model_schema(model: str) -> _schema.Schema:
+    """Get schema of the content model
+    """
+    if not is_model_registered(model):
+        raise KeyError("Model '{}' is not registered as content model.".format(model))
+
+    return _schema.get(model)
+
+
 def dispense(model: str, eid: str = None) -> Content:
     """Dispense a content entity
     """
@@ -98,6 +130,73 @@ def dispense(model: str, eid: str = None) -> Content:
     return e
 
 
+class _QueryScope:
+    """Context manager counting and timing a query of a finder
+    """
+
+    def __init__(self, kind: str, finder: odm.SingleModelFinder):
+        self._kind = kind
+        self._finder = finder
+        self._timer = None
+        self._start = None
+
+    def __enter__(self):
+        _metrics.count_op('queries')
+        self._timer = _metrics.timer('content.find.' + self._kind)
+        self._timer.__enter__()
+        self._start = perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._timer.__exit__(exc_type, exc_val, exc_tb)
+
+        if _profiler.is_profiling():
+            _profiler.record_query(self._kind, self._finder.mock.model, repr(self._finder.query.compile()),
+                                   (perf_counter() - self._start) * 1000, 'failed' if exc_type else 'ok')
+
+
+class _FinderResult:
+    """Finder's result which measures time of fetching entities
+
+    Cursors are lazy, so queries are executed while the result is being iterated.
+    """
+
+    def __init__(self, result, finder: odm.SingleModelFinder):
+        self._result = result
+        self._finder = finder
+
+    def __iter__(self):
+        with _QueryScope('get', self._finder):
+            for entity in self._result:
+                yield entity
+
+    def __len__(self) -> int:
+        return len(self._result)
+
+    def __getattr__(self, name: str):
+        return getattr(self._result, name)
+
+
+def _instrument_finder(finder: odm.SingleModelFinder) -> odm.SingleModelFinder:
+    """Make finder's queries counted and timed
+    """
+    get, count = finder.get, finder.count
+
+    def instrumented_get(*args, **kwargs):
+        return _FinderResult(get(*args, **kwargs), finder)
+
+    def instrumented_count(*args, **kwargs):
+        with _QueryScope('count', finder):
+            return count(*args, **kwargs)
+
+    finder.get = instrumented_get
+    finder.count = instrumented_count
+
+    return finder
+
+
+@_metrics.timed('content.find')
 def find(model: str, **kwargs) -> odm.SingleModelFinder:
     """Instantiate content entities finder
     """
@@ -109,10 +208,10 @@ def find(model: str, **kwargs) -> odm.SingleModelFinder:
         raise KeyError(f"Model '{model}' is not registered as content model")
 
     f = odm.find(model)
-    mock = f.mock  # type: Content
+    schema = _schema.get(model)
 
     # Publish time
-    if mock.has_field('publish_time'):
+    if schema.has_field('publish_time'):
         f.sort([('publish_time', odm.I_DESC)])
         if check_publish_time:
             f.lte('publish_time', datetime.now()).no_cache('publish_time')
@@ -120,11 +219,11 @@ def find(model: str, **kwargs) -> odm.SingleModelFinder:
         f.sort([('_modified', odm.I_DESC)])
 
     # Language
-    if language != '*' and mock.has_field('language'):
+    if language != '*' and schema.has_field('language'):
         f.eq('language', language)
 
     # Status
-    if status != '*' and mock.has_field('status'):
+    if status != '*' and schema.has_field('status'):
         if isinstance(status, str):
             status = [status]
         elif not isinstance(status, (list, tuple)):
@@ -132,7 +231,109 @@ def find(model: str, **kwargs) -> odm.SingleModelFinder:
 
         f.inc('status', status)
 
-    return f
+    return _instrument_finder(f)
+
+
+def search(model: str, query: str, limit: int = 20, **kwargs) -> List[Content]:
+    """Search for content entities, most relevant first
+
+    `kwargs` are passed to `find()`.
+    """
+    language = kwargs.setdefault('language', lang.get_current())
+    engine = _search.get_engine()
+    finder = find(model, **kwargs)
+
+    ids = engine.search(model, query, language, reg.get('content.search_max_results', 1000))
+    if ids is None:
+        # Engine doesn't rank results itself
+        engine.apply(finder, query, language)
+        return list(finder.get(limit))
+
+    if not ids:
+        return []
+
+    entities = {e.id: e for e in finder.inc('_id', ids).get()}
+
+    return [entities[eid] for eid in ids if eid in entities][:limit]
+
+
+def search_reindex(model: str) -> int:
+    """Rebuild search index of a content model
+    """
+    engine = _search.get_engine()
+
+    count = 0
+    for entity in find(model, language='*', status='*', check_publish_time=False).get():
+        engine.index(entity)
+        count += 1
+
+    return count
+
+
+def create_route_aliases(entities: Iterable[ContentWithURL]) -> int:
+    """Create route aliases of multiple entities at once
+
+    Alias strings are sanitized by route alias entities themselves. Existing aliases which may collide are fetched by a
+    single query, collisions are resolved in memory and aliases are inserted by a single write. New entities get
+    pre-allocated IDs and are expected to be saved by the caller, references of existing ones are updated by a single
+    bulk write. Returns number of created aliases.
+    """
+    entities = [e for e in entities if isinstance(e, ContentWithURL) and not e.route_alias]
+    if not entities:
+        return 0
+
+    # Unsaved route alias entities with sanitized alias strings
+    r_aliases = []
+    for entity in entities:
+        alias_str = entity.content_alter_route_alias_str((entity.f_get('tmp_route_alias_str') or '').strip())
+        r_aliases.append(route_alias.create(alias_str, entity.content_route_target(), entity.language))
+
+    # Fetch existing aliases which may collide by a single query
+    desired = [r_alias.alias for r_alias in r_aliases]
+    pattern = '^(?:{})(?:-\\d+)?$'.format('|'.join(re.escape(a) for a in set(desired)))
+    taken = {r_alias.f_get('alias') for r_alias in odm.find('route_alias').regex('alias', pattern).get()}
+
+    # Resolve collisions in memory the same way route aliases do, by appending a number
+    now = datetime.now()
+    docs = []
+    for r_alias, alias in zip(r_aliases, desired):
+        unique_alias, itr = alias, 0
+        while unique_alias in taken:
+            itr += 1
+            unique_alias = '{}-{}'.format(alias, itr)
+        taken.add(unique_alias)
+
+        if unique_alias != alias:
+            r_alias.f_set('alias', unique_alias)
+        r_alias.f_set('_id', ObjectId()).f_set('_created', now).f_set('_modified', now)
+
+        # Storable values are produced by the fields themselves
+        docs.append({f_name: field.get_storable_val() for f_name, field in r_alias.fields.items()})
+
+    r_alias_mock = odm.dispense('route_alias')
+    r_alias_mock.collection.insert_many(docs, ordered=False)
+    odm.clear_cache(r_alias_mock.model)
+
+    # Reload inserted aliases to reference them
+    inserted = {e.id: e for e in odm.find('route_alias').inc('_id', [doc['_id'] for doc in docs]).get()}
+
+    updates = {}  # type: Dict[str, Dict[str, dict]]
+    for entity, doc in zip(entities, docs):
+        is_new = entity.is_new
+        entity.f_set('route_alias', inserted[str(doc['_id'])]).f_rst('tmp_route_alias_str')
+
+        # Storable reference values are produced by the field itself
+        if not is_new:
+            updates.setdefault(entity.model, {})[entity.id] = {
+                'route_alias': entity.get_field('route_alias').get_storable_val(),
+            }
+
+    for model, model_updates in updates.items():
+        ops = [UpdateOne({'_id': ObjectId(eid)}, {'$set': values}) for eid, values in model_updates.items()]
+        dispense(model).collection.bulk_write(ops, ordered=False)
+        odm.clear_cache(model)
+
+    return len(entities)
 
 
 def find_by_url(url: str) -> Content:
@@ -182,99 +383,171 @@ def get_next_entity(entity: Content, same_author: bool = False, **kwargs) -> Opt
     return _get_adjacent_entity(entity, same_author, odm.I_ASC, **kwargs)
 
 
+@_metrics.timed('content.generate_rss', True)
 def generate_rss(model: str, filename: str, lng: str = '*',
                  finder_setup: Callable[[odm.SingleModelFinder], None] = None,
-                 item_setup: Callable[[feed.xml.Serializable, Content], None] = None, length: int = 20):
-    """Generate RSS feeds
+                 item_setup: Callable[[object, Content], None] = None, length: int = 20, fmt: str = 'rss',
+                 item_hook: Callable[[dict, Content], None] = None) -> str:
+    """Generate a feed
+
+    Items are streamed to the output file while entities are being iterated, so memory consumption does not depend on
+    feed's length. `item_hook` receives an item built by `feed_item()` and may modify it before writing.
+    Supported formats are 'rss', 'atom' and 'json'. Returns path of the generated file.
+
+    `item_setup` is deprecated, it receives `feed.rss.em.Item` as before and makes RSS feed to be built in memory.
     """
     # Setup finder
     finder = find(model, language=lng)
     if finder_setup:
         finder_setup(finder)
 
-    # Preparing output directory
-    output_dir = path.join(reg.get('paths.static'), 'feed')
-    if not path.exists(output_dir):
-        makedirs(output_dir, 0o755, True)
+    out_path = _feed.file_path(filename, lng, fmt)
+    if item_setup:
+        if fmt != 'rss':
+            raise ValueError("'item_setup' is supported only by RSS feeds, use 'item_hook' instead")
+        _generate_rss_legacy(finder, out_path, lng, item_setup, length)
+    else:
+        with _feed.get_writer(fmt, out_path, lng) as writer:
+            for entity in finder.get(length):
+                item = _feed.feed_item(entity)
+                if item_hook:
+                    item_hook(item, entity)
+                writer.write(item)
 
-    # Create generator
-    content_settings = reg.get('content')
-    parser = feed.rss.Parser()
+    _static.precompress(_feed.output_dir(), [path.basename(out_path)])
+    logger.info("Feed successfully written to '{}'.".format(out_path))
 
-    # Get <channel> element
-    channel = parser.get_children('channel')[0]
+    return out_path
 
-    # Channel title
-    channel.append_child(feed.rss.em.Title(content_settings.get('home_title_' + lng) or 'UNTITLED'))
 
-    # Channel description
-    channel.append_child(feed.rss.em.Description(content_settings.get('home_description_' + lng)))
+def _generate_rss_legacy(finder: odm.SingleModelFinder, out_path: str, lng: str, item_setup: Callable, length: int):
+    """Generate RSS feed in memory using `feed` plugin's elements, as it was done before streaming writers
+    """
+    from plugins import feed
 
-    # Channel link
+    parser = feed.rss.Parser()
+    channel = parser.get_children('channel')[0]
+    channel.append_child(feed.rss.em.Title(reg.get('content.home_title_' + lng) or 'UNTITLED'))
+    channel.append_child(feed.rss.em.Description(reg.get('content.home_description_' + lng)))
     channel.append_child(feed.rss.em.Link(router.base_url()))
-
-    # Channel language
     channel.append_child(feed.rss.em.Language(lng))
-
-    # Channel logo
     logo_url = router.url(reg.get('content.rss_logo_url', 'assets/app/img/logo-rss.png'))
     channel.append_child(feed.rss.yandex.Logo(logo_url))
     square_logo_url = router.url(reg.get('content.rss_square_logo_url', 'assets/app/img/logo-rss-square.png'))
     channel.append_child(feed.rss.yandex.Logo(square_logo_url, square=True))
 
-    # Append channel's items
     for entity in finder.get(length):
+        data = _feed.feed_item(entity)
         item = feed.rss.em.Item()
-        try:
-            item.append_child(feed.rss.em.Title(entity.title))
-            item.append_child(feed.rss.em.Link(entity.url))
-            item.append_child(feed.rss.em.PdaLink(entity.url))
-            item.append_child(feed.rss.em.Description(entity.description if entity.description else entity.title))
-            item.append_child(feed.rss.em.PubDate(entity.publish_time))
-            item.append_child(feed.rss.em.Author('{} ({})'.format(entity.author.login, entity.author.first_last_name)))
-        except odm.error.FieldNotDefined:
-            pass
-
-        # Section
-        if entity.has_field('section'):
-            item.append_child(feed.rss.em.Category(entity.section.title))
-
-        # Tags
-        if entity.has_field('tags'):
-            for tag in entity.tags:
-                item.append_child(feed.rss.pytsite.Tag(tag.title))
-
-        # Images
-        if entity.has_field('images') and entity.images:
-            # Attaching all the images as enclosures
-            for img in entity.images:
-                item.append_child(feed.rss.em.Enclosure(url=img.get_url(), length=img.length, type=img.mime))
-
-        # Video links
-        if entity.has_field('video_links') and entity.video_links:
+        item.append_child(feed.rss.em.Title(data['title']))
+        if data['url']:
+            item.append_child(feed.rss.em.Link(data['url']))
+            item.append_child(feed.rss.em.PdaLink(data['url']))
+        item.append_child(feed.rss.em.Description(data['description']))
+        item.append_child(feed.rss.em.PubDate(data['publish_time']))
+        if data['author']:
+            item.append_child(feed.rss.em.Author('{} ({})'.format(data['author']['login'], data['author']['name'])))
+        for category in data['categories']:
+            item.append_child(feed.rss.em.Category(category))
+        for tag in data['tags']:
+            item.append_child(feed.rss.pytsite.Tag(tag))
+        for enclosure in data['enclosures']:
+            item.append_child(feed.rss.em.Enclosure(**enclosure))
+        if data['videos']:
             m_group = item.append_child(feed.rss.media.Group())
-            for link_url in entity.video_links:
-                m_group.add_widget(feed.rss.media.Player(url=link_url))
-
-        # Body
-        if entity.has_field('body'):
-            item.append_child(feed.rss.yandex.FullText(entity.f_get('body', process_tags=False, remove_tags=True)))
-            item.append_child(feed.rss.content.Encoded(entity.f_get('body', process_tags=False, remove_tags=True)))
-            item.append_child(feed.rss.pytsite.FullText(entity.f_get('body', process_tags=False)))
-
-        if item_setup:
-            item_setup(item, entity)
-
+            for video in data['videos']:
+                m_group.add_widget(feed.rss.media.Player(url=video['url']))
+                if video['thumbnail']:
+                    m_group.add_widget(feed.rss.media.Thumbnail(url=video['thumbnail']))
+        if data['text'] is not None:
+            item.append_child(feed.rss.yandex.FullText(data['text']))
+            item.append_child(feed.rss.content.Encoded(data['html']))
+            item.append_child(feed.rss.pytsite.FullText(data['body']))
+
+        item_setup(item, entity)
         channel.append_child(item)
 
-    # Write feed content
-    out_path = path.join(output_dir, '{}-{}.xml'.format(filename, lng))
+    if not path.exists(_feed.output_dir()):
+        makedirs(_feed.output_dir(), 0o755, True)
+
     with open(out_path, 'wt', encoding='utf-8') as f:
         f.write(parser.generate())
 
-    logger.info("RSS feed successfully written to '{}'.".format(out_path))
+
+def _feed_routes(entity: Content, name: str, groups: Iterable[str]) -> List[Tuple[str, str]]:
+    """Get names and languages of feeds an entity belongs to
+    """
+    lng = entity.language if entity.has_field('language') else lang.get_current()
+
+    r = []
+    if 'all' in groups:
+        r.append((name, '*'))
+    if 'language' in groups:
+        r.append((name, lng))
+    if 'section' in groups and entity.has_field('section') and entity.section:
+        r.append(('{}-section-{}'.format(name, entity.section.id), lng))
+    if 'tag' in groups and entity.has_field('tags'):
+        r += [('{}-tag-{}'.format(name, tag.id), lng) for tag in entity.tags]
+    if 'author' in groups and entity.has_field('author') and entity.author:
+        r.append(('{}-author-{}'.format(name, entity.author.uid), lng))
+
+    return r
+
+
+@_metrics.timed('content.generate_feeds', True)
+def generate_feeds(model: str, groups: Iterable[str] = None, formats: Iterable[str] = None,
+                   length: int = None) -> Dict[str, int]:
+    """Generate all feeds of a model in a single pass over its entities
+
+    Feeds are grouped by 'language', 'all' languages, 'section', 'tag' and 'author'. Returns numbers of items written
+    to each feed file.
+    """
+    groups = tuple(groups or reg.get('content.feed_groups', ('language',)))
+    formats = formats or reg.get('content.feed_formats', ('rss',))
+    length = length or reg.get('content.feed_length', 20)
+    name = 'rss-{}'.format(model)
+
+    # Language-wide feeds are generated even if they are empty
+    # Feed of all languages keeps the file name produced by `generate_rss()` with `lng='*'`
+    fixed_routes = [(name, '*')] if 'all' in groups else []
+    if 'language' in groups:
+        fixed_routes += [(name, lng) for lng in lang.langs()]
+
+    fan_out = _feed.FanOut(formats, length)
+    try:
+        for route in fixed_routes:
+            fan_out.open(*route, writer_lng=lang.get_current() if route[1] == '*' else route[1])
+
+        for entity in find(model, language='*').get(reg.get('content.feed_scan_limit', 1000)):
+            lng = entity.language if entity.has_field('language') else lang.get_current()
+            fan_out.write(entity, _feed_routes(entity, name, groups), lng)
+
+            # Stop as soon as feeds have been filled, unless there are groups which are unknown in advance
+            if set(groups) <= {'language', 'all'} and fan_out.is_full(fixed_routes):
+                break
+
+        # Languages which newest entities are beyond scan limit are filled by their own queries. Scan and queries are
+        # sorted the same way, so entities which have already been written are skipped.
+        for route in fixed_routes:
+            written = fan_out.count(route)
+            if route[1] == '*' or written >= length:
+                continue
+
+            for entity in find(model, language=route[1]).skip(written).get(length - written):
+                fan_out.write(entity, [route], route[1])
+
+    except Exception:
+        fan_out.abort()
+        raise
+
+    r = fan_out.close()
+    _static.precompress(_feed.output_dir(), [path.basename(p) for p in r])
+    logger.info("{} feeds of model '{}' successfully written.".format(len(r), model))
+
+    return r
 
 
+@_metrics.timed('content.paginate', True)
 def paginate(finder: odm.SingleModelFinder, per_page: int = 10, css: str = '') -> dict:
     """Get paginated content finder query results
     """
@@ -290,7 +563,127 @@ def paginate(finder: odm.SingleModelFinder, per_page: int = 10, css: str = '') -
     }
 
 
+def set_status(model: str, ids: Iterable[str], status: str) -> List[str]:
+    """Change status of multiple entities at once
+
+    Entities which current user is not permitted to modify are skipped. Statuses are changed by a single update, so
+    `Content.content_on_status_change()` hook is not called: publish times are updated by the update itself,
+    notifications are sent as digests and `content@entities.set_status` event is fired instead. Save events are fired
+    for each changed entity. Returns IDs of changed entities.
+    """
+    schema = get_model_schema(model)
+    if not schema.has_field('status'):
+        raise RuntimeError("Model '{}' doesn't support statuses".format(model))
+
+    mock = dispense(model)
+    statuses = schema.statuses
+    if status not in statuses:
+        raise ValueError("'{}' is invalid content status for model '{}'".format(status, model))
+
+    # Model level permissions are checked only once
+    user = auth.get_current_user()
+    can_modify = mock.content_check_model_permission(PERM_MODIFY, user)
+    can_modify_own = can_modify or mock.content_check_model_permission(PERM_MODIFY_OWN, user)
+    can_bypass_moderation = mock.content_check_model_permission(CONTENT_PERM_BYPASS_MODERATION, user)
+    if not can_modify_own:
+        return []
+
+    # Content must be reviewed by moderator
+    if status == CONTENT_STATUS_PUBLISHED and CONTENT_STATUS_WAITING in statuses and not can_bypass_moderation:
+        status = CONTENT_STATUS_WAITING
+
+    # Select entities allowed to be changed
+    f = find(model, language='*', status='*', check_publish_time=False).inc('_id', list(ids)).ne('status', status)
+    if not can_modify:
+        f.eq('author', user.uid)
+    entities = list(f.get())
+
+    # Authors cannot change their own entities while they are waiting for moderation
+    if not can_modify and not can_bypass_moderation:
+        entities = [e for e in entities if e.status != CONTENT_STATUS_WAITING]
+    if not entities:
+        return []
+
+    # Single multi-document update, previous statuses and publish times are calculated by database server
+    now = datetime.now()
+    new_values = {'prev_status': '$status', 'status': status, '_modified': now}
+    if schema.has_field('publish_time') and status in (CONTENT_STATUS_WAITING, CONTENT_STATUS_PUBLISHED):
+        new_values['publish_time'] = {'$cond': [
+            {'$and': [{'$eq': ['$status', CONTENT_STATUS_UNPUBLISHED]}, {'$lt': ['$publish_time', now]}]},
+            now,
+            '$publish_time',
+        ]}
+    mock.collection.update_many({'_id': {'$in': [ObjectId(e.id) for e in entities]}}, [{'$set': new_values}])
+    _metrics.count_op('writes')
+    odm.clear_cache(model)
+
+    # Reload entities to get actual values
+    entities = list(find(model, language='*', status='*', check_publish_time=False)
+                    .inc('_id', [e.id for e in entities]).get())
+
+    _notify_status_change_digest(entities, status)
+
+    # Listeners like search index and autocomplete keep their data in sync with saved entities
+    for entity in entities:
+        events.fire('content@entity.save', entity=entity)
+        events.fire('content@entity.{}.save'.format(model), entity=entity)
+
+    changed_ids = [e.id for e in entities]
+    events.fire('content@entities.set_status', model=model, ids=changed_ids, status=status)
+
+    return changed_ids
+
+
+def _notify_status_change_digest(entities: List[Content], status: str):
+    """Notify authors and administrators about status changes, single message per recipient
+    """
+    c_user = auth.get_current_user()
+    mail_lang = lang.get_current()
+
+    # Authors
+    if reg.get('content.status_change_author_notification', True):
+        by_author = {}  # type: Dict[str, List[Content]]
+        for e in entities:
+            if e.author and e.author != c_user:
+                by_author.setdefault(e.author.uid, []).append(e)
+
+        for author_entities in by_author.values():
+            author = author_entities[0].author
+            m_body = tpl.render('content@mail/{}/content-status-change-digest'.format(mail_lang), {
+                'user': author,
+                'entities': author_entities,
+                'status': author_entities[0].t('content_status_{}_{}'.format(author_entities[0].model, status)),
+            })
+            mail.Message(author.login, lang.t('content@content_status_change_mail_subject'), m_body).send()
+
+    # Administrators
+    if status == CONTENT_STATUS_WAITING and reg.get('content.waiting_status_admin_notification', True) \
+            and not c_user.is_admin:
+        for admin_user in auth.get_admin_users():
+            m_body = tpl.render('content@mail/{}/waiting-content-digest'.format(mail_lang), {
+                'user': admin_user,
+                'entities': entities,
+            })
+            mail.Message(admin_user.login, lang.t('content@content_waiting_mail_subject'), m_body).send()
+
+
+def as_jsonable_bulk(entities: Iterable[Content], **kwargs) -> List[dict]:
+    """Get JSONable representations of multiple entities
+
+    References resolved while serializing an entity (authors, tags) are shared with all other entities of the batch.
+    """
+    kwargs.setdefault('jsonable_refs', {})
+
+    return [entity.as_jsonable(**kwargs) for entity in entities]
+
+
 def on_content_view(handler: Callable[[ContentWithURL], None], priority: int = 0):
     """Shortcut
     """
     events.listen('content@view', handler, priority)
+
+
+def on_content_published(handler: Callable[[Content], None], priority: int = 0):
+    """Shortcut
+    """
+    events.listen('content@entity.published', handler, priority)
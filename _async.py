@@ -0,0 +1,113 @@
+"""PytSite Content Plugin Asynchronous API
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from pytsite import reg, lang
+from plugins import odm, auth, widget
+from . import _api
+from ._model import Content
+
+_executor = None  # type: Optional[ThreadPoolExecutor]
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    with _executor_lock:
+        if not _executor:
+            _executor = ThreadPoolExecutor(reg.get('content.async_workers', 8), 'content-async')
+
+    return _executor
+
+
+async def run(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking function in the thread pool
+
+    Current language and user are propagated to the pool's thread.
+    """
+    language = lang.get_current()
+    user = auth.get_current_user()
+
+    def call():
+        lang.set_current(language)
+        auth.switch_user(user)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            auth.restore_user()
+
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+
+
+async def find_async(model: str, limit: int = 0, setup: Callable[[odm.SingleModelFinder], None] = None,
+                     **kwargs) -> List[Content]:
+    """Find content entities without blocking the event loop
+
+    `kwargs` are passed to `find()`, `setup` is called with the finder before executing the query.
+    """
+
+    def query():
+        f = _api.find(model, **kwargs)
+        if setup:
+            setup(f)
+
+        return list(f.get(limit))
+
+    return await run(query)
+
+
+async def paginate_async(finder: odm.SingleModelFinder, per_page: int = 10, css: str = '') -> dict:
+    """Asynchronous version of `paginate()`
+
+    Pager is created in the calling thread, because it depends on the current request.
+    """
+    total = await run(finder.count)
+    pager = widget.select.Pager('content-pager', total_items=total, per_page=per_page, css=css)
+    entities = await run(lambda: list(finder.skip(pager.skip).get(pager.limit)))
+
+    return {
+        'entities': entities,
+        'pager': pager,
+    }
+
+
+async def gather_blocks_async(blocks: Dict[str, Union[Awaitable, Callable[[], Any]]],
+                              return_exceptions: bool = False) -> Dict[str, Any]:
+    """Assemble independent page blocks concurrently within a running event loop
+
+    Blocks are awaitables, i. e. `find_async()` calls, or blocking callables which are run in the thread pool.
+    Returns results keyed the same way as blocks. If `return_exceptions` is True, failed blocks' results are exceptions
+    instead of failing the whole page.
+    """
+    keys = list(blocks.keys())
+    awaitables = [b if not callable(b) else run(b) for b in blocks.values()]
+
+    return dict(zip(keys, await asyncio.gather(*awaitables, return_exceptions=return_exceptions)))
+
+
+def gather_blocks(blocks: Dict[str, Union[Awaitable, Callable[[], Any]]], return_exceptions: bool = False) -> \
+        Dict[str, Any]:
+    """Assemble independent page blocks concurrently from synchronous code, i. e. controllers
+
+    Runs a new event loop, so it cannot be called while an event loop is running in the current thread, use
+    `gather_blocks_async()` there.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise RuntimeError('gather_blocks() cannot be called from a running event loop, use gather_blocks_async()')
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(gather_blocks_async(blocks, return_exceptions))
+    finally:
+        loop.close()
@@ -0,0 +1,167 @@
+"""PytSite Content Plugin Title Autocompletion
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import re
+from bisect import bisect_left, insort
+from threading import Lock
+from time import time
+from typing import List, Dict, Tuple, Union
+from pytsite import reg
+from plugins import odm
+from . import _search
+
+_KEY_MAX_LEN = 64
+
+_caches = {}  # type: Dict[Tuple[str, str], _PrefixCache]
+_caches_lock = Lock()
+
+
+def title_prefix_keys(title: str) -> List[str]:
+    """Get prefix keys of a title: normalized title suffixes starting at each word
+    """
+    words = _search.words(title or '')
+
+    return [' '.join(words[i:])[:_KEY_MAX_LEN] for i in range(len(words))]
+
+
+def normalize_prefix(prefix: str) -> str:
+    """Normalize a search prefix the same way as prefix keys are normalized
+    """
+    return ' '.join(_search.words(prefix))[:_KEY_MAX_LEN]
+
+
+class _PrefixCache:
+    """Prefix cache of most recent entities of a model in a language
+    """
+
+    def __init__(self, entries: List[Tuple[str, List[str]]], complete: bool):
+        """Init
+
+        :param entries: (entity ID, prefix keys) pairs, most recent first
+        :param complete: whether all the model's entities in the language are cached
+        """
+        self.complete = complete
+        self.expires = time() + reg.get('content.autocomplete_cache_ttl', 600)
+        self._keys = []  # type: List[Tuple[str, str]]
+        self._entity_keys = {}  # type: Dict[str, List[str]]
+        self._rank = {}  # type: Dict[str, float]
+
+        for i, (eid, keys) in enumerate(entries):
+            self._rank[eid] = i
+            self._entity_keys[eid] = keys
+            self._keys.extend((k, eid) for k in keys)
+
+        self._keys.sort()
+
+    def __len__(self) -> int:
+        return len(self._entity_keys)
+
+    def put(self, eid: str, keys: List[str]):
+        """Add or update an entity, updated entities become the most recent ones
+        """
+        self.remove(eid)
+        self._rank[eid] = -time()
+        self._entity_keys[eid] = keys
+        for k in keys:
+            insort(self._keys, (k, eid))
+
+    def remove(self, eid: str):
+        for k in self._entity_keys.pop(eid, ()):
+            i = bisect_left(self._keys, (k, eid))
+            if i < len(self._keys) and self._keys[i] == (k, eid):
+                del self._keys[i]
+        self._rank.pop(eid, None)
+
+    def lookup(self, prefix: str, limit: int) -> List[str]:
+        """Get IDs of entities having a key starting with prefix, most recent first
+        """
+        found = set()
+        i = bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and self._keys[i][0].startswith(prefix):
+            found.add(self._keys[i][1])
+            i += 1
+
+        return sorted(found, key=self._rank.get)[:limit]
+
+
+def _build_cache(model: str, language: str) -> _PrefixCache:
+    from . import _api
+
+    size = reg.get('content.autocomplete_cache_size', 1000)
+    f = _api.find(model, language=language, status='*', check_publish_time=False)
+    entries = [(e.id, e.f_get('title_prefix_keys')) for e in f.get(size)]
+
+    return _PrefixCache(entries, len(entries) < size)
+
+
+def _get_cache(model: str, language: str) -> _PrefixCache:
+    with _caches_lock:
+        c = _caches.get((model, language))
+        if c and c.expires > time():
+            return c
+
+    c = _build_cache(model, language)
+    with _caches_lock:
+        _caches[(model, language)] = c
+
+    return c
+
+
+def autocomplete(model: str, prefix: str, language: str, limit: int = 20) -> List[str]:
+    """Get IDs of entities which title contains a word starting with prefix
+
+    Only most recent entities are looked up, see `content.autocomplete_cache_size` registry option.
+    """
+    prefix = normalize_prefix(prefix)
+
+    return _get_cache(model, language).lookup(prefix, limit) if prefix else []
+
+
+def apply(finder: Union[odm.SingleModelFinder, odm.MultiModelFinder], model: str, prefix: str, language: str):
+    """Filter a finder by title prefix
+    """
+    limit = reg.get('content.autocomplete_limit', 20)
+    cache = _get_cache(model, language)
+    ids = cache.lookup(normalize_prefix(prefix), limit)
+
+    # Cached results are enough
+    if cache.complete or len(ids) >= limit:
+        finder.inc('_id', ids)
+    else:
+        _search.get_engine().apply_prefix(finder, model, prefix, language)
+
+
+def apply_regex(finder: Union[odm.SingleModelFinder, odm.MultiModelFinder], prefix: str):
+    """Filter a finder by title prefix using the index
+    """
+    finder.regex('title_prefix_keys', '^' + re.escape(normalize_prefix(prefix)))
+
+
+def on_entity_save(entity):
+    """Update cached prefix keys of an entity
+
+    :type entity: plugins.content.model.Content
+    """
+    if not entity.has_field('title_prefix_keys'):
+        return
+
+    with _caches_lock:
+        c = _caches.get((entity.model, entity.language))
+        if c:
+            c.put(entity.id, entity.f_get('title_prefix_keys'))
+            if len(c) > reg.get('content.autocomplete_cache_size', 1000) * 1.1:
+                del _caches[(entity.model, entity.language)]
+
+
+def on_entity_delete(entity):
+    """Remove an entity from cache
+
+    :type entity: plugins.content.model.Content
+    """
+    with _caches_lock:
+        c = _caches.get((entity.model, entity.language))
+        if c:
+            c.remove(entity.id)
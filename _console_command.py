@@ -6,10 +6,15 @@ __license__ = 'MIT'
 
 import requests
 import re
+import sys
+import subprocess
+import tracemalloc
+from time import perf_counter
 from random import shuffle, randint
+from typing import Dict
 from pytsite import console, lang, events
 from plugins import file, auth, query
-from . import _api
+from . import _api, _profiler, _transfer, _reindex
 from ._constants import CONTENT_STATUS_PUBLISHED
 
 _TEXT_CLEANUP_RE = re.compile('[,:;?\\-.]')
@@ -138,3 +143,286 @@ class Generate(console.Command):
         title = ' '.join(title[0:max_words])
 
         return title
+
+
+class SearchReindex(console.Command):
+    """Rebuild search index
+    """
+
+    @property
+    def name(self) -> str:
+        """Get command's name
+        """
+        return 'content:search_reindex'
+
+    @property
+    def description(self) -> str:
+        """Get command's description
+        """
+        return 'content@console_search_reindex_command_description'
+
+    def exec(self):
+        """Execute the command
+        """
+        models = self.args or list(_api.get_models().keys())
+
+        for model in models:
+            if not _api.is_model_registered(model):
+                raise console.error.CommandExecutionError("'{}' is not a registered content model".format(model))
+
+            count = _api.search_reindex(model)
+            console.print_info(lang.t('content@search_reindex_done', {'model': model, 'count': count}))
+
+
+class ProfilerReport(console.Command):
+    """Summarize slow calls profiling reports
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(console.option.PositiveInt('limit', default=10))
+
+    @property
+    def name(self) -> str:
+        """Get command's name
+        """
+        return 'content:profiler_report'
+
+    @property
+    def description(self) -> str:
+        """Get command's description
+        """
+        return 'content@console_profiler_report_command_description'
+
+    def exec(self):
+        """Execute the command
+        """
+        summary = _profiler.summarize(self.opt('limit'))
+        if not summary:
+            console.print_info(lang.t('content@profiler_no_reports'))
+            return
+
+        for t in summary:
+            console.print_info('{}: {} slow call(s), avg {:.0f} ms, max {:.0f} ms, {} queries'.format(
+                t['target'], t['count'], t['avg_ms'], t['max_ms'], t['queries']))
+            for frame, count in t['top_frames']:
+                console.print_info('    {:>6}  {}'.format(count, frame))
+
+
+class Benchmark(console.Command):
+    """Compare costs of model metadata lookups
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(console.option.PositiveInt('num', default=1000))
+        self.define_option(console.option.Bool('startup'))
+
+    @property
+    def name(self) -> str:
+        """Get command's name
+        """
+        return 'content:benchmark'
+
+    @property
+    def description(self) -> str:
+        """Get command's description
+        """
+        return 'content@console_benchmark_command_description'
+
+    @staticmethod
+    def _measure(func, num: int) -> tuple:
+        """Measure time and memory allocated by `num` calls of a function
+        """
+        tracemalloc.start()
+        start = perf_counter()
+        for _ in range(num):
+            func()
+        duration = (perf_counter() - start) * 1000
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return duration, allocated
+
+    @staticmethod
+    def _startup(num: int):
+        """Measure startup time of console processes and import time of plugins
+        """
+        durations = []
+        imports = {}  # type: Dict[str, int]
+        for _ in range(num):
+            start = perf_counter()
+            r = subprocess.run([sys.executable, '-X', 'importtime', sys.argv[0]], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+            durations.append((perf_counter() - start) * 1000)
+
+            # Lines format: 'import time: self [us] | cumulative | imported package'
+            for line in r.stderr.splitlines():
+                parts = line.split('|')
+                if len(parts) == 3 and parts[2].strip().startswith('plugins.'):
+                    module = parts[2].strip()
+                    imports[module] = imports.get(module, 0) + int(parts[1])
+
+        console.print_info('Startup: {} run(s), avg {:.0f} ms, min {:.0f} ms'.format(
+            num, sum(durations) / num, min(durations)))
+
+        for module, total in sorted(imports.items(), key=lambda x: x[1], reverse=True)[:20]:
+            console.print_info('    {:>8.1f} ms  {}'.format(total / num / 1000, module))
+
+    def exec(self):
+        """Execute the command
+        """
+        num = self.opt('num')
+
+        if self.opt('startup'):
+            return self._startup(min(num, 10))
+
+        models = self.args or list(_api.get_models().keys())
+
+        for model in models:
+            if not _api.is_model_registered(model):
+                raise console.error.CommandExecutionError("'{}' is not a registered content model".format(model))
+
+            cases = (
+                ('dispense().has_field()', lambda: _api.dispense(model).has_field('title')),
+                ('get_model_schema().has_field()', lambda: _api.get_model_schema(model).has_field('title')),
+                ('find()', lambda: _api.find(model)),
+            )
+
+            for title, func in cases:
+                duration, allocated = self._measure(func, num)
+                console.print_info('{}: {} x {}: {:.1f} ms, {:.1f} us per call, peak {} KB allocated'.format(
+                    model, num, title, duration, duration * 1000 / num, allocated // 1024))
+
+            # Bulk iteration over up to `num` entities
+            cases = (
+                ('entities', lambda: list(_api.find(model, language='*').get(num))),
+                ('records', lambda: list(_api.records(_api.find(model, language='*'), ('_modified',), limit=num))),
+            )
+
+            for title, func in cases:
+                duration, allocated = self._measure(func, 1)
+                console.print_info('{}: iterating {} {}: {:.1f} ms, peak {} KB allocated'.format(
+                    model, num, title, duration, allocated // 1024))
+
+
+class Export(console.Command):
+    """Export content entities to a file
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(console.option.Str('lang', default='*'))
+        self.define_option(console.option.Bool('resume'))
+        self.define_option(console.option.PositiveInt('workers'))
+        self.define_option(console.option.PositiveInt('batch'))
+
+    @property
+    def name(self) -> str:
+        """Get command's name
+        """
+        return 'content:export'
+
+    @property
+    def description(self) -> str:
+        """Get command's description
+        """
+        return 'content@console_export_command_description'
+
+    def exec(self):
+        """Execute the command
+        """
+        model, file_path = self.arg(0), self.arg(1)
+
+        if not _api.is_model_registered(model):
+            raise console.error.CommandExecutionError("'{}' is not a registered content model".format(model))
+
+        if not file_path:
+            raise console.error.CommandExecutionError('Output file path is not specified')
+
+        count = _transfer.export(model, file_path, self.opt('lang'), self.opt('resume'), self.opt('workers'),
+                                 self.opt('batch'), lambda n: console.print_info('{}: {}'.format(model, n)))
+        console.print_info(lang.t('content@export_done', {'model': model, 'count': count, 'path': file_path}))
+
+
+class Import(console.Command):
+    """Import content entities from a file
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(console.option.Bool('raw'))
+        self.define_option(console.option.Bool('resume'))
+        self.define_option(console.option.PositiveInt('workers'))
+        self.define_option(console.option.PositiveInt('batch'))
+
+    @property
+    def name(self) -> str:
+        """Get command's name
+        """
+        return 'content:import'
+
+    @property
+    def description(self) -> str:
+        """Get command's description
+        """
+        return 'content@console_import_command_description'
+
+    def exec(self):
+        """Execute the command
+        """
+        file_path = self.arg(0)
+
+        if not file_path:
+            raise console.error.CommandExecutionError('Input file path is not specified')
+
+        counts = _transfer.import_(file_path, self.opt('raw'), self.opt('resume'), self.opt('workers'),
+                                   self.opt('batch'), lambda n: console.print_info('{}: {}'.format(file_path, n)))
+        for model, count in counts.items():
+            console.print_info(lang.t('content@import_done', {'model': model, 'count': count}))
+
+
+class Reindex(console.Command):
+    """Recompute denormalized fields of content entities
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(console.option.Bool('dry-run'))
+        self.define_option(console.option.PositiveInt('workers'))
+
+    @property
+    def name(self) -> str:
+        """Get command's name
+        """
+        return 'content:reindex'
+
+    @property
+    def description(self) -> str:
+        """Get command's description
+        """
+        return 'content@console_reindex_command_description'
+
+    def exec(self):
+        """Execute the command
+        """
+        models = self.args or list(_api.get_models().keys())
+
+        for model in models:
+            if not _api.is_model_registered(model):
+                raise console.error.CommandExecutionError("'{}' is not a registered content model".format(model))
+
+        dry_run = self.opt('dry-run')
+        for model, diff in _reindex.recompute_models(models, dry_run, self.opt('workers')).items():
+            if not diff:
+                console.print_info(lang.t('content@reindex_nothing_changed', {'model': model}))
+                continue
+
+            for f_name, count in sorted(diff.items()):
+                msg_id = 'content@reindex_diff' if dry_run else 'content@reindex_done'
+                console.print_info(lang.t(msg_id, {'model': model, 'field': f_name, 'count': count}))
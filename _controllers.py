@@ -4,11 +4,12 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
+import hmac
 from datetime import datetime
-from pytsite import router, metatag, lang, routing, tpl, events
+from pytsite import router, metatag, lang, routing, tpl, events, http, reg
 from plugins import auth, odm, taxonomy, hreflang, widget
 from plugins.odm_auth import PERM_MODIFY, PERM_DELETE
-from . import _model
+from . import _model, _metrics, _profiler
 from ._constants import CONTENT_PERM_VIEW, CONTENT_STATUS_UNPUBLISHED, CONTENT_STATUS_WAITING
 
 
@@ -16,6 +17,8 @@ class Index(routing.Controller):
     """Content Entities Index
     """
 
+    @_profiler.profiled('content.index')
+    @_metrics.timed('content.controller.index', True)
     def exec(self):
         # Delayed import to prevent circular dependency
         from . import _api
@@ -93,6 +96,8 @@ class View(routing.Controller):
     """Content Entity View
     """
 
+    @_profiler.profiled('content.view')
+    @_metrics.timed('content.controller.view', True)
     def exec(self):
         from . import _api
 
@@ -137,6 +142,8 @@ class View(routing.Controller):
         # Meta description
         if entity.has_field('description'):
             description = entity.f_get('description')
+            if not description and entity.has_field('body_text'):
+                description = entity.excerpt
             metatag.t_set('description', description)
             metatag.t_set('og:description', description)
             metatag.t_set('twitter:description', description)
@@ -192,3 +199,62 @@ class View(routing.Controller):
         except routing.error.RuleNotFound:
             # Render a template provided by application
             return tpl.render('content/view', self.args)
+
+
+class SetStatus(routing.Controller):
+    """Change Status of Multiple Entities
+    """
+
+    def exec(self):
+        from . import _api
+
+        model = self.arg('model')
+        if not _api.is_model_registered(model):
+            raise self.not_found()
+
+        ids = self.arg('ids', [])
+        if isinstance(ids, str):
+            ids = ids.split(',')
+
+        try:
+            changed = _api.set_status(model, ids, self.arg('status'))
+        except (ValueError, RuntimeError) as e:
+            raise http.error.BadRequest(str(e))
+
+        router.session().add_success_message(lang.t('content@status_changed', {'count': len(changed)}))
+
+        return self.redirect(router.rule_url('odm_ui@admin_browse', {'model': model}))
+
+
+class Metrics(routing.Controller):
+    """Metrics in Prometheus Text Format
+    """
+
+    def _is_allowed(self) -> bool:
+        """Check if metrics can be exposed to the client
+
+        Administrators, clients which IP address is in `content.metrics_allowlist` and clients which provide
+        `content.metrics_token` as a bearer token are allowed.
+        """
+        if auth.get_current_user().is_admin:
+            return True
+
+        if self.request.remote_addr in reg.get('content.metrics_allowlist', ()):
+            return True
+
+        token = reg.get('content.metrics_token')
+        auth_header = self.request.headers.get('Authorization', '')
+        if token and auth_header.startswith('Bearer '):
+            return hmac.compare_digest(auth_header[7:].strip(), token)
+
+        return False
+
+    def exec(self):
+        sink = _metrics.get_sink()
+        if not isinstance(sink, _metrics.PrometheusSink):
+            raise self.not_found()
+
+        if not self._is_allowed():
+            raise self.forbidden()
+
+        return http.Response(sink.render(), mimetype='text/plain; version=0.0.4')
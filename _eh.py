@@ -4,21 +4,36 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from os import path, makedirs
+from os import path, makedirs, rename
 from shutil import rmtree
 from datetime import datetime
-from pytsite import reg, logger, tpl, mail, lang, router
+from typing import Dict, List
+from pytsite import reg, logger, tpl, mail, lang, router, mongodb, events
 from plugins import comments, sitemap, flag, auth
-from . import _api
+from . import _api, _search, _autocomplete, _metrics, _jobs, _scheduler, _static, _ranking
 from ._model import Content, ContentWithURL
-
-_sitemap_generation_works = False
+from ._constants import CONTENT_STATUS_PUBLISHED
 
 
 def on_cron_hourly():
     """pytsite.cron.hourly
     """
     _generate_feeds()
+    _refresh_ranking()
+
+
+def on_router_dispatch():
+    """pytsite.router.dispatch
+    """
+    _api.setup_admin_menus()
+
+
+def on_cron_every_min():
+    """pytsite.cron.every_min
+    """
+    _scheduler.refresh()
+    _ranking.flush()
+    _update_queued_feeds()
 
 
 def on_cron_daily():
@@ -39,10 +54,55 @@ def on_content_view(entity: ContentWithURL):
             auth.restore_user()
 
 
+def on_content_entity_save(entity: Content):
+    """content@entity.save
+    """
+    _search.get_engine().index(entity)
+    _autocomplete.on_entity_save(entity)
+    _scheduler.schedule(entity)
+
+
+def on_content_entity_delete(entity: Content):
+    """content@entity.delete
+    """
+    _search.get_engine().remove(entity.model, entity.id)
+    _autocomplete.on_entity_delete(entity)
+    _scheduler.unschedule(entity.model, entity.id)
+    _ranking.remove(entity.model, entity.id)
+
+
+def on_content_entities_set_status(model: str, ids: List[str], status: str):
+    """content@entities.set_status
+    """
+    try:
+        auth.switch_user_to_system()
+        now = datetime.now()
+        for entity in _api.find(model, language='*', status='*', check_publish_time=False).inc('_id', ids).get():
+            _scheduler.schedule(entity)
+
+            # Scheduled publications are notified by scheduler
+            if status == CONTENT_STATUS_PUBLISHED and entity.has_field('publish_time') \
+                    and entity.publish_time <= now:
+                events.fire('content@entity.published', entity=entity)
+    finally:
+        auth.restore_user()
+
+
+def on_content_entity_published(entity: Content):
+    """content@entity.published
+    """
+    # Feeds of the model are updated by the next every minute cron run instead of waiting for hourly regeneration
+    if entity.model in reg.get('content.rss_models', ()):
+        _feeds_queue().replace_one({'_id': entity.model}, {'queued': datetime.now()}, True)
+
+
 def on_comments_create_comment(comment: comments.model.AbstractComment):
     """comments.create_comment
     """
     entity = _api.find_by_url(comment.thread_uid)
+    if entity:
+        _ranking.hit(entity, 'comments')
+
     if comment.is_reply or not entity or comment.author == entity.author:
         return
 
@@ -53,6 +113,15 @@ def on_comments_create_comment(comment: comments.model.AbstractComment):
     mail.Message(entity.author.login, subject, body, m_from).send()
 
 
+def on_flag_create(flg: flag.Flag):
+    """flag.create
+    """
+    if isinstance(flg.entity, Content) and flg.variant == 'like':
+        _ranking.hit(flg.entity, 'likes')
+
+    on_flag_toggle(flg)
+
+
 def on_flag_toggle(flg: flag.Flag):
     if not isinstance(flg.entity, Content):
         return
@@ -66,65 +135,124 @@ def on_flag_toggle(flg: flag.Flag):
             auth.restore_user()
 
 
-def _generate_sitemap():
-    """Generate content sitemap
-    """
-    global _sitemap_generation_works
-
-    if _sitemap_generation_works:
-        raise RuntimeError('Sitemap generation is still in progress')
+def _sitemap_output_dir() -> str:
+    return path.join(reg.get('paths.static'), 'sitemap')
 
-    _sitemap_generation_works = True
-    logger.info('Sitemap generation start.')
 
-    output_dir = path.join(reg.get('paths.static'), 'sitemap')
-    if path.exists(output_dir):
-        rmtree(output_dir)
-    makedirs(output_dir, 0o755, True)
+def _sitemap_shard(shard: str) -> List[str]:
+    """Generate sitemap files for a model in a language
+    """
+    model, lng = shard.split(':')
 
-    sitemap_index = sitemap.Index()
+    tmp_dir = _sitemap_output_dir() + '.tmp'
     links_per_file = 50000
-    loop_count = 1
-    loop_links = 1
+    files = []
+
+    logger.info("Sitemap generation started for model '{}', language '{}'".format(model, lang.lang_title(lng)))
+
     sm = sitemap.Sitemap()
-    sm.add_url(router.base_url(), datetime.now(), 'always', 1)
-    for lng in lang.langs():
-        for model in reg.get('content.sitemap_models', ()):
-            logger.info("Sitemap generation started for model '{}', language '{}'".
-                        format(model, lang.lang_title(lng)))
-
-            for entity in _api.find(model, language=lng):  # type: ContentWithURL
-                sm.add_url(entity.url, entity.publish_time)
-                loop_links += 1
-
-                # Flush sitemap
-                if loop_links >= links_per_file:
-                    loop_count += 1
-                    loop_links = 0
-                    sitemap_path = sm.write(path.join(output_dir, 'data-%02d.xml' % loop_count), True)
-                    logger.info("'{}' successfully written with {} links".format(sitemap_path, loop_links))
-                    sitemap_index.add_url(router.url('/sitemap/{}'.format(path.basename(sitemap_path))))
-                    del sm
-                    sm = sitemap.Sitemap()
+    for entity in _api.find(model, language=lng):  # type: ContentWithURL
+        sm.add_url(entity.url, entity.publish_time)
+
+        # Flush sitemap
+        if len(sm) >= links_per_file:
+            file_name = 'data-{}-{}-{:02d}.xml'.format(model, lng, len(files) + 1)
+            sitemap_path = sm.write(path.join(tmp_dir, file_name), True)
+            logger.info("'{}' successfully written with {} links".format(sitemap_path, len(sm)))
+            files.append(path.basename(sitemap_path))
+            sm = sitemap.Sitemap()
 
     # If non-flushed sitemap exist
     if len(sm):
-        sitemap_path = sm.write(path.join(output_dir, 'data-%02d.xml' % loop_count), True)
-        logger.info("'{}' successfully written with {} links.".format(sitemap_path, loop_links))
-        sitemap_index.add_url(router.url('/sitemap/{}'.format(path.basename(sitemap_path))))
+        file_name = 'data-{}-{}-{:02d}.xml'.format(model, lng, len(files) + 1)
+        sitemap_path = sm.write(path.join(tmp_dir, file_name), True)
+        logger.info("'{}' successfully written with {} links".format(sitemap_path, len(sm)))
+        files.append(path.basename(sitemap_path))
+
+    return files
+
+
+def _sitemap_init():
+    """Prepare temporary sitemap directory
+    """
+    tmp_dir = _sitemap_output_dir() + '.tmp'
+    if path.exists(tmp_dir):
+        rmtree(tmp_dir)
+    makedirs(tmp_dir, 0o755, True)
+
+
+def _sitemap_finalize(results: Dict[str, List[str]]):
+    """Write sitemap index and replace previously generated sitemap
+    """
+    output_dir = _sitemap_output_dir()
+    tmp_dir = output_dir + '.tmp'
+
+    sm = sitemap.Sitemap()
+    sm.add_url(router.base_url(), datetime.now(), 'always', 1)
+    files = [path.basename(sm.write(path.join(tmp_dir, 'data-00.xml'), True))]
+    for shard_files in results.values():
+        files.extend(shard_files)
+
+    sitemap_index = sitemap.Index()
+    for file_name in files:
+        sitemap_index.add_url(router.url('/sitemap/{}'.format(file_name)))
+    sitemap_index_path = sitemap_index.write(path.join(tmp_dir, 'index.xml'))
+    logger.info("'{}' successfully written.".format(sitemap_index_path))
+
+    # Pre-compressed siblings and metadata for static serving
+    _static.precompress(tmp_dir, files + [path.basename(sitemap_index_path)], output_dir)
+
+    if path.exists(output_dir):
+        rmtree(output_dir)
+    rename(tmp_dir, output_dir)
 
-    if len(sitemap_index):
-        sitemap_index_path = sitemap_index.write(path.join(output_dir, 'index.xml'))
-        logger.info("'{}' successfully written.".format(sitemap_index_path))
 
-    logger.info('Sitemap generation stop.')
-    _sitemap_generation_works = False
+@_metrics.timed('content.generate_sitemap', True)
+def _generate_sitemap():
+    """Generate content sitemap
+    """
+    shards = ['{}:{}'.format(model, lng) for lng in lang.langs() for model in reg.get('content.sitemap_models', ())]
+    job = _jobs.Job('sitemap', shards, _sitemap_shard, _sitemap_finalize, _sitemap_init)
+
+    logger.info('Sitemap generation start.')
+    if job.run():
+        logger.info('Sitemap generation stop.')
+
+
+def _feed_shard(model: str) -> Dict[str, int]:
+    """Generate all feeds of a model
+    """
+    return _api.generate_feeds(model)
+
+
+def _feeds_queue():
+    return mongodb.get_collection('content_feeds_queue')
+
+
+def _update_queued_feeds():
+    """Regenerate feeds of models which entities have been published recently
+    """
+    queued = [doc['_id'] for doc in _feeds_queue().find()]
+    if not queued:
+        return
+
+    # Queue items are kept if feeds are being generated by another process, they are processed by the next run
+    started = datetime.now()
+    models = [m for m in queued if m in reg.get('content.rss_models', ())]
+    # Own job name, so checkpoints of the hourly job are neither consumed nor removed by this one
+    if _jobs.Job('feeds-queued', models, _feed_shard).run():
+        _feeds_queue().delete_many({'_id': {'$in': queued}, 'queued': {'$lte': started}})
 
 
 def _generate_feeds():
-    # For each language we have separate feed
-    for lng in lang.langs():
-        # Generate RSS feed for each model
-        for model in reg.get('content.rss_models', ()):
-            filename = 'rss-{}'.format(model)
-            _api.generate_rss(model, filename, lng, length=reg.get('content.feed_length', 20))
+    # Each model is scanned once to fill all its feeds
+    _jobs.Job('feeds', reg.get('content.rss_models', ()), _feed_shard).run()
+
+
+@_metrics.timed('content.refresh_ranking', True)
+def _refresh_ranking():
+    """Rebuild all ranking lists, so entities which events went out of windows are dropped
+    """
+    _ranking.flush()
+    _ranking.refresh()
+    _ranking.prune()
@@ -0,0 +1,516 @@
+"""PytSite Content Plugin Streaming Feed Writers
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import json
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from datetime import datetime
+from email.utils import format_datetime
+from os import path, makedirs, replace, unlink
+from uuid import uuid4
+from typing import Dict, List, Type, Iterable, Tuple
+from xml.sax.saxutils import escape, quoteattr
+from pytsite import reg, router
+
+_RSS_NAMESPACES = {
+    'yandex': 'http://news.yandex.ru',
+    'media': 'http://search.yahoo.com/mrss/',
+    'content': 'http://purl.org/rss/1.0/modules/content/',
+    'pytsite': 'https://pytsite.xyz',
+}
+
+
+def _iso_time(d: datetime) -> str:
+    return d.astimezone().isoformat()
+
+
+def _rfc822_time(d: datetime) -> str:
+    return format_datetime(d.astimezone())
+
+
+def _el(name: str, value, **attrs) -> str:
+    attrs = ''.join(' {}={}'.format(k, quoteattr(str(v))) for k, v in attrs.items() if v is not None)
+    if value is None:
+        return '<{}{} />'.format(name, attrs)
+
+    return '<{0}{1}>{2}</{0}>'.format(name, attrs, escape(str(value)))
+
+
+def _cdata(name: str, value: str) -> str:
+    return '<{0}><![CDATA[{1}]]></{0}>'.format(name, value.replace(']]>', ']]]]><![CDATA[>'))
+
+
+def feed_item(entity) -> dict:
+    """Build a feed item from an entity
+
+    Feed items are plain dicts, so they can be rendered once and written to any number of feeds of any format.
+
+    :type entity: plugins.content.model.Content
+    """
+    item = {
+        'id': '{}:{}'.format(entity.model, entity.id),
+        'title': entity.title if entity.has_field('title') else '',
+        'url': entity.url if entity.has_field('route_alias') else None,
+        'description': '',
+        'publish_time': entity.publish_time if entity.has_field('publish_time') else entity.created,
+        'author': None,
+        'categories': [],
+        'tags': [],
+        'enclosures': [],
+        'videos': [],
+        'text': None,
+        'html': None,
+        'body': None,
+    }
+
+    if entity.has_field('description'):
+        item['description'] = entity.description
+    if not item['description'] and entity.has_field('body'):
+        item['description'] = entity.excerpt
+    if not item['description']:
+        item['description'] = item['title']
+
+    if entity.has_field('author') and entity.author:
+        item['author'] = {'login': entity.author.login, 'name': entity.author.first_last_name}
+
+    if entity.has_field('section') and entity.section:
+        item['categories'].append(entity.section.title)
+
+    if entity.has_field('tags'):
+        item['tags'] = [tag.title for tag in entity.tags]
+
+    if entity.has_field('images'):
+        item['enclosures'] = [{'url': img.get_url(), 'length': img.length, 'type': img.mime} for img in entity.images]
+
+    if entity.has_field('video_links') and entity.video_links:
+        video_meta = entity.video_meta if entity.has_field('video_meta') else ()
+        for i, link_url in enumerate(entity.video_links):
+            thumbnail = video_meta[i].get('thumbnail') if i < len(video_meta) else None
+            item['videos'].append({'url': link_url, 'thumbnail': thumbnail})
+
+    if entity.has_field('body'):
+        item['text'] = entity.body_text
+        item['html'] = entity.f_get('body', process_tags=False, remove_tags=True)
+        item['body'] = entity.f_get('body', process_tags=False)
+
+    return item
+
+
+class Writer(ABC):
+    """Base Streaming Feed Writer
+
+    Items are written to a temporary file one by one as they arrive, so memory consumption does not depend on feed
+    length. The file is moved to its destination when the writer is closed.
+    """
+
+    suffix = '.xml'
+    mime = 'application/xml'
+    separator = ''
+
+    def __init__(self, file_path: str, lng: str, title: str = None, description: str = None, url: str = None):
+        self._path = file_path
+        # Unique temporary file, so concurrent generations of the same feed don't interfere
+        self._tmp_path = '{}.{}.tmp'.format(file_path, uuid4().hex)
+        self._lng = lng
+        self._title = title or reg.get('content.home_title_' + lng) or 'UNTITLED'
+        self._description = description or reg.get('content.home_description_' + lng) or ''
+        self._url = url or router.base_url()
+        self._f = None
+        self._is_open = False
+        self._items_count = 0
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def items_count(self) -> int:
+        return self._items_count
+
+    def open(self):
+        """Open the writer and write feed's header
+        """
+        output_dir = path.dirname(self._path)
+        if not path.exists(output_dir):
+            makedirs(output_dir, 0o755, True)
+
+        self._f = open(self._tmp_path, 'wt', encoding='utf-8')
+        self._f.write(self._header())
+        self._is_open = True
+
+        return self
+
+    def render(self, item: dict) -> str:
+        """Render an item
+
+        Rendered items do not depend on a writer's state, so they can be shared between writers of the same class.
+        """
+        return self._item(item)
+
+    def write(self, item: dict, rendered: str = None):
+        """Write an item
+        """
+        if not self._f:
+            self._f = open(self._tmp_path, 'at', encoding='utf-8')
+
+        if self._items_count and self.separator:
+            self._f.write(self.separator)
+
+        self._f.write(rendered if rendered is not None else self._item(item))
+        self._items_count += 1
+
+    def suspend(self):
+        """Release file handle of the writer, it is reopened by the next write
+        """
+        if self._f:
+            self._f.close()
+            self._f = None
+
+    def close(self):
+        """Write feed's footer and move the file to its destination
+        """
+        if not self._f:
+            self._f = open(self._tmp_path, 'at', encoding='utf-8')
+
+        self._f.write(self._footer())
+        self._f.close()
+        self._f = None
+        self._is_open = False
+        replace(self._tmp_path, self._path)
+
+    def abort(self):
+        """Close the writer discarding written data
+        """
+        self.suspend()
+        if self._is_open:
+            self._is_open = False
+            unlink(self._tmp_path)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    @abstractmethod
+    def _header(self) -> str:
+        pass
+
+    @abstractmethod
+    def _item(self, item: dict) -> str:
+        pass
+
+    @abstractmethod
+    def _footer(self) -> str:
+        pass
+
+
+class RSSWriter(Writer):
+    """RSS 2.0 Streaming Feed Writer
+    """
+
+    mime = 'application/rss+xml'
+
+    def _header(self) -> str:
+        logo_url = router.url(reg.get('content.rss_logo_url', 'assets/app/img/logo-rss.png'))
+        square_logo_url = router.url(reg.get('content.rss_square_logo_url', 'assets/app/img/logo-rss-square.png'))
+        ns = ' '.join('xmlns:{}={}'.format(k, quoteattr(v)) for k, v in _RSS_NAMESPACES.items())
+
+        return ''.join((
+            '<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<rss version="2.0" {}><channel>'.format(ns),
+            _el('title', self._title),
+            _el('description', self._description),
+            _el('link', self._url),
+            _el('language', self._lng),
+            _el('yandex:logo', logo_url),
+            _el('yandex:logo', square_logo_url, type='square'),
+        ))
+
+    def _item(self, item: dict) -> str:
+        r = ['<item>', _el('title', item['title'])]
+
+        if item['url']:
+            r.append(_el('link', item['url']))
+            r.append(_el('pdalink', item['url']))
+            r.append(_el('guid', item['url']))
+
+        r.append(_el('description', item['description']))
+        r.append(_el('pubDate', _rfc822_time(item['publish_time'])))
+
+        if item['author']:
+            r.append(_el('author', '{} ({})'.format(item['author']['login'], item['author']['name'])))
+
+        for category in item['categories']:
+            r.append(_el('category', category))
+
+        for tag in item['tags']:
+            r.append(_el('pytsite:tag', tag))
+
+        for enc in item['enclosures']:
+            r.append(_el('enclosure', None, url=enc['url'], length=enc['length'], type=enc['type']))
+
+        if item['videos']:
+            r.append('<media:group>')
+            for video in item['videos']:
+                r.append(_el('media:player', None, url=video['url']))
+                if video['thumbnail']:
+                    r.append(_el('media:thumbnail', None, url=video['thumbnail']))
+            r.append('</media:group>')
+
+        if item['text'] is not None:
+            r.append(_el('yandex:full-text', item['text']))
+            r.append(_cdata('content:encoded', item['html']))
+            r.append(_cdata('pytsite:fullText', item['body']))
+
+        r.append('</item>')
+
+        return ''.join(r)
+
+    def _footer(self) -> str:
+        return '</channel></rss>\n'
+
+
+class AtomWriter(Writer):
+    """Atom Streaming Feed Writer
+    """
+
+    suffix = '.atom'
+    mime = 'application/atom+xml'
+
+    def _header(self) -> str:
+        return ''.join((
+            '<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<feed xmlns="http://www.w3.org/2005/Atom" xml:lang={}>'.format(quoteattr(self._lng)),
+            _el('id', self._url),
+            _el('title', self._title),
+            _el('subtitle', self._description),
+            _el('link', None, href=self._url),
+            _el('updated', _iso_time(datetime.now())),
+        ))
+
+    def _item(self, item: dict) -> str:
+        r = [
+            '<entry>',
+            _el('id', item['url'] or 'urn:{}'.format(item['id'])),
+            _el('title', item['title']),
+            _el('updated', _iso_time(item['publish_time'])),
+            _el('published', _iso_time(item['publish_time'])),
+            _el('summary', item['description']),
+        ]
+
+        if item['url']:
+            r.append(_el('link', None, href=item['url']))
+
+        if item['author']:
+            r.append('<author>{}</author>'.format(_el('name', item['author']['name'])))
+
+        for category in item['categories'] + item['tags']:
+            r.append(_el('category', None, term=category))
+
+        for enc in item['enclosures']:
+            r.append(_el('link', None, rel='enclosure', href=enc['url'], length=enc['length'], type=enc['type']))
+
+        if item['html'] is not None:
+            r.append(_el('content', item['html'], type='html'))
+
+        r.append('</entry>')
+
+        return ''.join(r)
+
+    def _footer(self) -> str:
+        return '</feed>\n'
+
+
+class JSONFeedWriter(Writer):
+    """JSON Feed 1.1 Streaming Writer
+    """
+
+    suffix = '.json'
+    mime = 'application/feed+json'
+    separator = ', '
+
+    def _header(self) -> str:
+        header = json.dumps({
+            'version': 'https://jsonfeed.org/version/1.1',
+            'title': self._title,
+            'description': self._description,
+            'home_page_url': self._url,
+            'language': self._lng,
+        }, ensure_ascii=False)
+
+        # Leave the object open to stream items into it
+        return header[:-1] + ', "items": ['
+
+    def _item(self, item: dict) -> str:
+        r = {
+            'id': item['url'] or item['id'],
+            'title': item['title'],
+            'summary': item['description'],
+            'date_published': _iso_time(item['publish_time']),
+        }
+
+        if item['url']:
+            r['url'] = item['url']
+        if item['author']:
+            r['authors'] = [{'name': item['author']['name']}]
+        if item['categories'] or item['tags']:
+            r['tags'] = item['categories'] + item['tags']
+        if item['enclosures']:
+            r['image'] = item['enclosures'][0]['url']
+            r['attachments'] = [{'url': e['url'], 'mime_type': e['type'], 'size_in_bytes': e['length']}
+                                for e in item['enclosures']]
+        if item['html'] is not None:
+            r['content_html'] = item['html']
+            r['content_text'] = item['text']
+
+        return json.dumps(r, ensure_ascii=False)
+
+    def _footer(self) -> str:
+        return ']}\n'
+
+
+_writers = {
+    'rss': RSSWriter,
+    'atom': AtomWriter,
+    'json': JSONFeedWriter,
+}  # type: Dict[str, Type[Writer]]
+
+
+def register_writer(fmt: str, cls: Type[Writer]):
+    """Register a feed writer class
+    """
+    if not issubclass(cls, Writer):
+        raise TypeError('Subclass of {} expected, got {}'.format(Writer, cls))
+
+    _writers[fmt] = cls
+
+
+def _check_format(fmt: str):
+    if fmt not in _writers:
+        raise ValueError("Unknown feed format: '{}'".format(fmt))
+
+
+def get_writer(fmt: str, file_path: str, lng: str, **kwargs) -> Writer:
+    """Get a feed writer instance
+    """
+    _check_format(fmt)
+
+    return _writers[fmt](file_path, lng, **kwargs)
+
+
+def get_formats() -> List[str]:
+    """Get names of registered feed formats
+    """
+    return list(_writers.keys())
+
+
+class FanOut:
+    """Feeds Fan-out
+
+    Routes entities to any number of feeds in any number of formats. Each entity is converted to an item and rendered
+    once per format, no matter how many feeds it belongs to. Number of simultaneously open files is limited by
+    `content.feed_max_open_files` registry option.
+    """
+
+    def __init__(self, formats: Iterable[str], length: int):
+        self._formats = list(formats)
+        self._length = length
+        self._writers = {}  # type: Dict[Tuple[str, str, str], Writer]
+        self._active = OrderedDict()  # type: Dict[Tuple[str, str, str], Writer]
+        self._counts = {}  # type: Dict[Tuple[str, str], int]
+        self._max_open = reg.get('content.feed_max_open_files', 256)
+
+    def _writer(self, filename: str, lng: str, fmt: str, writer_lng: str) -> Writer:
+        key = (filename, lng, fmt)
+
+        writer = self._writers.get(key)
+        if not writer:
+            writer = self._writers[key] = get_writer(fmt, file_path(filename, lng, fmt), writer_lng).open()
+
+        self._active[key] = writer
+        self._active.move_to_end(key)
+        while len(self._active) > self._max_open:
+            self._active.popitem(False)[1].suspend()
+
+        return writer
+
+    def open(self, filename: str, lng: str, writer_lng: str = None):
+        """Open a feed, so it is generated even if no items are routed to it
+        """
+        for fmt in self._formats:
+            self._writer(filename, lng, fmt, writer_lng or lng)
+
+        self._counts.setdefault((filename, lng), 0)
+
+    def count(self, route: Tuple[str, str]) -> int:
+        """Get number of items written to a feed
+        """
+        return self._counts.get(route, 0)
+
+    def is_full(self, routes: Iterable[Tuple[str, str]]) -> bool:
+        """Check whether all feeds are full
+        """
+        return all(self._counts.get(route, 0) >= self._length for route in routes)
+
+    def write(self, entity, routes: Iterable[Tuple[str, str]], writer_lng: str = None):
+        """Write an entity to feeds
+
+        :type entity: plugins.content.model.Content
+        """
+        routes = [r for r in routes if self._counts.get(r, 0) < self._length]
+        if not routes:
+            return
+
+        item = feed_item(entity)
+        rendered = {}  # type: Dict[str, str]
+        for filename, lng in routes:
+            for fmt in self._formats:
+                writer = self._writer(filename, lng, fmt, writer_lng or lng)
+                if fmt not in rendered:
+                    rendered[fmt] = writer.render(item)
+                writer.write(item, rendered[fmt])
+
+            self._counts[(filename, lng)] = self._counts.get((filename, lng), 0) + 1
+
+    def close(self) -> Dict[str, int]:
+        """Close all feeds
+
+        Returns numbers of items written to each feed file.
+        """
+        r = {}
+        for writer in self._writers.values():
+            writer.close()
+            r[writer.path] = writer.items_count
+
+        self._writers.clear()
+        self._active.clear()
+
+        return r
+
+    def abort(self):
+        """Close all feeds discarding written data
+        """
+        for writer in self._writers.values():
+            writer.abort()
+
+        self._writers.clear()
+        self._active.clear()
+
+
+def output_dir() -> str:
+    return path.join(reg.get('paths.static'), 'feed')
+
+
+def file_path(filename: str, lng: str, fmt: str = 'rss') -> str:
+    """Get path of a feed file
+    """
+    _check_format(fmt)
+
+    return path.join(output_dir(), '{}-{}{}'.format(filename, lng, _writers[fmt].suffix))
@@ -4,18 +4,22 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from pytsite import routing, mail, lang, tpl
+from pytsite import routing, http, mail, lang, tpl
 from plugins import auth, odm, query
 from plugins.odm_auth import PERM_MODIFY, PERM_DELETE
-from . import _api
+from . import _api, _profiler, _ranking
 
 
 class PatchViewsCount(routing.Controller):
     """Increase content entity views counter by one
     """
 
+    @_profiler.profiled('content.patch_views_count')
     def exec(self) -> int:
         entity = _api.dispense(self.arg('model'), self.arg('uid'))
+        if entity:
+            _ranking.hit(entity, 'views')
+
         if entity and entity.has_field('views_count'):
             try:
                 auth.switch_user_to_system()
@@ -28,10 +32,30 @@ class PatchViewsCount(routing.Controller):
         return 0
 
 
+class PatchStatus(routing.Controller):
+    """Change status of multiple content entities
+    """
+
+    def exec(self) -> dict:
+        model = self.arg('model')
+        if not _api.is_model_registered(model):
+            raise self.not_found()
+
+        ids = self.arg('ids', [])
+        if isinstance(ids, str):
+            ids = ids.split(',')
+
+        try:
+            return {'ids': _api.set_status(model, ids, self.arg('status'))}
+        except (ValueError, RuntimeError) as e:
+            raise http.error.BadRequest(str(e))
+
+
 class PostAbuse(routing.Controller):
     """Report Abuse
     """
 
+    @_profiler.profiled('content.post_abuse')
     def exec(self):
         reporter = auth.get_current_user()
         if reporter.is_anonymous:
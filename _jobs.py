@@ -0,0 +1,204 @@
+"""PytSite Content Plugin Background Jobs
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import json
+import fcntl
+import threading
+from os import path, makedirs, replace, unlink
+from time import perf_counter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Dict, Any, List, Optional
+from pytsite import reg, logger
+from . import _metrics
+
+_HISTORY_LENGTH = 100
+
+
+def jobs_dir() -> str:
+    """Get directory of jobs' locks, checkpoints and history
+    """
+    r = path.join(reg.get('paths.storage'), 'content', 'jobs')
+    if not path.exists(r):
+        makedirs(r, 0o755, True)
+
+    return r
+
+
+class FileLock:
+    """Cross-process file lock
+    """
+
+    def __init__(self, name: str, blocking: bool = False):
+        self._path = path.join(jobs_dir(), name + '.lock')
+        self._blocking = blocking
+        self._f = None
+
+    def acquire(self) -> bool:
+        """Try to acquire the lock
+        """
+        self._f = open(self._path, 'w')
+        try:
+            fcntl.flock(self._f, fcntl.LOCK_EX if self._blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._f.close()
+            self._f = None
+            return False
+
+    def release(self):
+        """Release the lock
+        """
+        if self._f:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RuntimeError("Lock '{}' is held by another process".format(self._path))
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class Job:
+    """Resumable Sharded Job
+
+    Work is split into shards identified by string keys. Shards are processed by a pool of workers, results of
+    completed shards are checkpointed, so an interrupted job skips them while being run next time.
+    """
+
+    def __init__(self, name: str, shards: Iterable[str], worker: Callable[[str], Any],
+                 finalizer: Callable[[Dict[str, Any]], None] = None, initializer: Callable[[], None] = None,
+                 workers: int = None):
+        """Init
+
+        :param worker: processes a shard, returns a JSON serializable result
+        :param finalizer: called with results of all shards after all of them have been processed
+        :param initializer: called before processing shards, unless an interrupted run is being resumed
+        """
+        self._name = name
+        self._shards = list(shards)
+        self._worker = worker
+        self._finalizer = finalizer
+        self._initializer = initializer
+        self._workers = workers or reg.get('content.jobs_workers', 1)
+        self._checkpoint_path = path.join(jobs_dir(), name + '.checkpoint.json')
+        self._checkpoint_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def _load_checkpoint(self) -> dict:
+        if not path.exists(self._checkpoint_path):
+            return {'started': datetime.now().isoformat(), 'results': {}}
+
+        with open(self._checkpoint_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_checkpoint(self, checkpoint: dict):
+        tmp_path = self._checkpoint_path + '.tmp'
+        with open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        replace(tmp_path, self._checkpoint_path)
+
+    def _run_shard(self, shard: str, checkpoint: dict, timings: Dict[str, float]):
+        start = perf_counter()
+        with _metrics.timer('content.job.{}.shard'.format(self._name)):
+            result = self._worker(shard)
+
+        with self._checkpoint_lock:
+            timings[shard] = (perf_counter() - start) * 1000
+            checkpoint['results'][shard] = result
+            self._save_checkpoint(checkpoint)
+
+        logger.info("Job '{}': shard '{}' completed in {:.0f} ms".format(self._name, shard, timings[shard]))
+
+    def run(self) -> bool:
+        """Run the job
+
+        Returns False if the job is already running in another process.
+        """
+        lock = FileLock(self._name)
+        if not lock.acquire():
+            logger.warn("Job '{}' is already running".format(self._name))
+            return False
+
+        start = perf_counter()
+        timings = {}  # type: Dict[str, float]
+        error = None  # type: Optional[str]
+        try:
+            if self._initializer and not path.exists(self._checkpoint_path):
+                self._initializer()
+
+            checkpoint = self._load_checkpoint()
+            pending = [s for s in self._shards if s not in checkpoint['results']]
+            if len(pending) < len(self._shards):
+                logger.info("Job '{}' resumed, {} of {} shards are already completed".
+                            format(self._name, len(self._shards) - len(pending), len(self._shards)))
+
+            if self._workers > 1:
+                with ThreadPoolExecutor(self._workers) as executor:
+                    for future in [executor.submit(self._run_shard, s, checkpoint, timings) for s in pending]:
+                        future.result()
+            else:
+                for shard in pending:
+                    self._run_shard(shard, checkpoint, timings)
+
+            if self._finalizer:
+                self._finalizer({s: checkpoint['results'][s] for s in self._shards})
+
+            if path.exists(self._checkpoint_path):
+                unlink(self._checkpoint_path)
+
+            return True
+
+        except Exception as e:
+            error = str(e)
+            raise
+
+        finally:
+            lock.release()
+            duration = (perf_counter() - start) * 1000
+            _metrics.observe('content.job.{}'.format(self._name), duration)
+            _append_history({
+                'job': self._name,
+                'finished': datetime.now().isoformat(),
+                'duration_ms': duration,
+                'shards': timings,
+                'error': error,
+            })
+
+
+def _append_history(record: dict):
+    history_path = path.join(jobs_dir(), 'history.jsonl')
+
+    with FileLock('history', True):
+        lines = []
+        if path.exists(history_path):
+            with open(history_path, encoding='utf-8') as f:
+                lines = f.readlines()[-(_HISTORY_LENGTH - 1):]
+
+        lines.append(json.dumps(record) + '\n')
+        with open(history_path, 'wt', encoding='utf-8') as f:
+            f.writelines(lines)
+
+
+def get_history(job: str = None) -> List[dict]:
+    """Get history of jobs runs, most recent first
+    """
+    history_path = path.join(jobs_dir(), 'history.jsonl')
+    if not path.exists(history_path):
+        return []
+
+    with open(history_path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    return [r for r in reversed(records) if not job or r['job'] == job]
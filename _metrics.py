@@ -0,0 +1,238 @@
+"""PytSite Content Plugin Metrics
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import socket
+import threading
+from abc import ABC, abstractmethod
+from time import perf_counter
+from functools import wraps
+from typing import Dict, List, Optional, Callable
+from pytsite import reg, logger
+
+_sink = None  # type: Optional[Sink]
+_local = threading.local()
+
+
+class Sink(ABC):
+    """Base Metrics Sink
+    """
+
+    @abstractmethod
+    def incr(self, name: str, value: int = 1):
+        """Increment a counter
+        """
+        pass
+
+    @abstractmethod
+    def observe(self, name: str, value: float):
+        """Record an observation, i. e. timing in milliseconds
+        """
+        pass
+
+
+class LogSink(Sink):
+    """Log Metrics Sink
+    """
+
+    def incr(self, name: str, value: int = 1):
+        logger.info('Metric {}: +{}'.format(name, value))
+
+    def observe(self, name: str, value: float):
+        logger.info('Metric {}: {:.3f}'.format(name, value))
+
+
+class PrometheusSink(Sink):
+    """Prometheus Metrics Sink
+
+    Metrics are aggregated in memory and rendered in Prometheus text format by `content@metrics` route.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # type: Dict[str, int]
+        self._summaries = {}  # type: Dict[str, List[float]]
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            summary = self._summaries.setdefault(name, [0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+
+    def render(self) -> str:
+        """Render metrics in Prometheus text exposition format
+        """
+        lines = []
+
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                name = name.replace('.', '_') + '_total'
+                lines.append('# TYPE {} counter'.format(name))
+                lines.append('{} {}'.format(name, value))
+
+            for name, (count, total) in sorted(self._summaries.items()):
+                name = name.replace('.', '_')
+                lines.append('# TYPE {} summary'.format(name))
+                lines.append('{}_count {}'.format(name, count))
+                lines.append('{}_sum {}'.format(name, total))
+
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdSink(Sink):
+    """StatsD Metrics Sink
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8125, prefix: str = ''):
+        self._address = (host, port)
+        self._prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, data: str):
+        try:
+            self._socket.sendto(data.encode('ascii'), self._address)
+        except OSError:
+            pass
+
+    def incr(self, name: str, value: int = 1):
+        self._send('{}{}:{}|c'.format(self._prefix, name, value))
+
+    def observe(self, name: str, value: float):
+        self._send('{}{}:{:.3f}|ms'.format(self._prefix, name, value))
+
+
+class _Timer:
+    """Timer context manager
+    """
+
+    def __init__(self, name: str, count_ops: bool = False):
+        self._name = name
+        self._ops = {'queries': 0, 'writes': 0} if count_ops else None
+        self._start = None
+
+    def __enter__(self):
+        if self._ops is not None:
+            if not hasattr(_local, 'scopes'):
+                _local.scopes = []
+            _local.scopes.append(self._ops)
+
+        self._start = perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = (perf_counter() - self._start) * 1000
+
+        sink = _sink
+        if self._ops is not None:
+            _local.scopes.remove(self._ops)
+            if sink:
+                sink.observe(self._name + '.queries', self._ops['queries'])
+                sink.observe(self._name + '.writes', self._ops['writes'])
+
+        if sink:
+            sink.observe(self._name, elapsed)
+            if exc_type:
+                sink.incr(self._name + '.errors')
+
+
+class _NullTimer:
+    """Timer which does nothing, used while metrics are disabled
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def set_sink(sink: Optional[Sink]):
+    """Set metrics sink, None disables metrics
+    """
+    global _sink
+
+    _sink = sink
+
+
+def get_sink() -> Optional[Sink]:
+    """Get current metrics sink
+    """
+    return _sink
+
+
+def configure():
+    """Setup metrics sink according to `content.metrics_sink` registry option
+    """
+    sink_type = reg.get('content.metrics_sink')
+
+    if not sink_type:
+        set_sink(None)
+    elif sink_type == 'log':
+        set_sink(LogSink())
+    elif sink_type == 'prometheus':
+        set_sink(PrometheusSink())
+    elif sink_type == 'statsd':
+        set_sink(StatsdSink(reg.get('content.metrics_statsd_host', '127.0.0.1'),
+                            reg.get('content.metrics_statsd_port', 8125),
+                            reg.get('content.metrics_statsd_prefix', '')))
+    else:
+        raise ValueError("Unknown metrics sink type: '{}'".format(sink_type))
+
+
+def count_op(kind: str):
+    """Count an operation, 'queries' or 'writes', in all active scopes
+
+    Operations are counted where the plugin issues them, i. e. by finders returned from `find()` and by entities' hooks.
+    """
+    for ops in getattr(_local, 'scopes', ()):
+        ops[kind] += 1
+
+
+def incr(name: str, value: int = 1):
+    """Increment a counter
+    """
+    if _sink:
+        _sink.incr(name, value)
+
+
+def observe(name: str, value: float):
+    """Record an observation
+    """
+    if _sink:
+        _sink.observe(name, value)
+
+
+def timer(name: str, count_ops: bool = False):
+    """Get a context manager measuring execution time
+
+    If `count_ops` is True, number of database queries and writes performed inside the context are recorded too.
+    """
+    return _Timer(name, count_ops) if _sink else _NULL_TIMER
+
+
+def timed(name: str, count_ops: bool = False) -> Callable:
+    """Decorator measuring execution time of a function
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sink:
+                return func(*args, **kwargs)
+
+            with _Timer(name, count_ops):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
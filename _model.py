@@ -5,15 +5,20 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 import re
-import htmler
-from typing import Tuple, List, Union
+import math
+import hashlib
+import threading
+from typing import Tuple, List, Union, Callable, Dict, Optional
+from html import unescape as html_unescape
+from bson import ObjectId
 from frozendict import frozendict
 from datetime import datetime
 from dicmer import dict_merge
-from pytsite import validation, lang, events, util, mail, tpl, reg, router, errors, routing
+from pytsite import validation, lang, events, util, mail, tpl, reg, router, errors, routing, cache, logger
 from plugins import auth, ckeditor, route_alias, auth_ui, auth_storage_odm, file_storage_odm, odm_ui, odm, file, form, \
     widget, file_ui, tag, taxonomy, comments, flag
 from plugins.odm_auth import PERM_CREATE, PERM_MODIFY, PERM_DELETE, PERM_MODIFY_OWN, PERM_DELETE_OWN
+from . import _metrics, _profiler, _render, _perm_cache
 from ._constants import CONTENT_PERM_VIEW, CONTENT_PERM_VIEW_OWN, CONTENT_PERM_BYPASS_MODERATION, \
     CONTENT_PERM_SET_PUBLISH_TIME, CONTENT_PERM_SET_LOCALIZATION, CONTENT_STATUS_UNPUBLISHED, CONTENT_STATUS_WAITING, \
     CONTENT_STATUS_PUBLISHED
@@ -24,11 +29,28 @@ _html_img_tag_re = re.compile('<img.*?src\\s*=["\']([^"\']+)["\'][^>]*>')
 _html_video_youtube_re = re.compile(
     '<iframe.*?src=["\']?(?:https?:)?//www\\.youtube\\.com/embed/([a-zA-Z0-9_-]{11})[^"\']*["\']?.+?</iframe>'
 )
+_html_tag_re = re.compile('<[^>]*>')
+_spaces_re = re.compile('\\s+')
 _html_video_facebook_re = re.compile(
     '<iframe.*?src=["\']?(?:https?:)?//www\\.facebook\\.com/plugins/video\\.php\\?href=([^"\']+)["\']?.+?</iframe>'
 )
 
+# Logical saves currently in progress in each thread
+_save_local = threading.local()
 
+# Logical saves and physical writes counters
+_save_stats = {'saves': 0, 'writes': 0}
+_save_stats_lock = threading.Lock()
+
+
+def get_save_stats() -> Dict[str, int]:
+    """Get counters of logical saves and physical writes of content entities
+    """
+    with _save_stats_lock:
+        return dict(_save_stats)
+
+
+@_metrics.timed('content.process_tags')
 def _process_tags(entity, inp: str, responsive_images: bool = True, images_width: int = None) -> str:
     """Converts body tags like [img] into HTML tags
 
@@ -94,21 +116,8 @@ def _process_tags(entity, inp: str, responsive_images: bool = True, images_width
             responsive = False
             width = images_width
 
-        # HTML code
-        if responsive:
-            r = img.get_responsive_html(alt, enlarge=enlarge, css=util.escape_html(img_css))
-        else:
-            r = img.get_html(alt, width=width, height=height, enlarge=enlarge, css=util.escape_html(img_css))
-
-        # Link to original file
-        if link_orig:
-            link = htmler.A(r, href=img.url, target=link_target, title=util.escape_html(alt))
-            if link_class:
-                link.set_attr('css', util.escape_html(link_class))
-
-            r = str(link)
-
-        return r
+        return _render.render_image(img, alt, img_css, enlarge, width, height, responsive, link_orig, link_target,
+                                    link_class)
 
     def process_vid_tag(match):
         """Converts single body [vid] tag into video player HTML code
@@ -117,7 +126,7 @@ def _process_tags(entity, inp: str, responsive_images: bool = True, images_width
         if len(entity.video_links) < vid_index:
             return ''
 
-        return str(widget.misc.VideoPlayer('content-video-' + str(vid_index), value=entity.video_links[vid_index - 1]))
+        return _render.render_video(entity.video_links[vid_index - 1], 'content-video-' + str(vid_index))
 
     inp = _body_img_tag_re.sub(process_img_tag, inp)
     inp = _body_vid_tag_re.sub(process_vid_tag, inp)
@@ -125,6 +134,7 @@ def _process_tags(entity, inp: str, responsive_images: bool = True, images_width
     return inp
 
 
+@_metrics.timed('content.extract_images')
 def _extract_images(entity) -> tuple:
     """Transforms inline HTML <img> tags into [img] tags
 
@@ -148,6 +158,7 @@ def _extract_images(entity) -> tuple:
     return body, images
 
 
+@_metrics.timed('content.extract_video_links')
 def _extract_video_links(entity) -> tuple:
     """Transforms embedded video players code into [vid] tags
 
@@ -177,6 +188,54 @@ def _extract_video_links(entity) -> tuple:
     return body, vid_links
 
 
+def _jsonable_field_filter(kwargs: dict) -> Callable[[str], bool]:
+    """Get a function which checks whether a key should be included into entity's JSONable representation
+    """
+    fields = kwargs.get('fields')
+    exclude = kwargs.get('exclude')
+
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    if isinstance(exclude, str):
+        exclude = exclude.split(',')
+
+    fields = {f.strip() for f in fields} if fields else None
+    exclude = {f.strip() for f in exclude} if exclude else set()
+
+    return lambda key: key not in exclude and (fields is None or key in fields)
+
+
+def _modified_str(obj) -> str:
+    """Get modification time of an entity, a user or a file as a string
+    """
+    modified = obj.f_get('_modified') if isinstance(obj, odm.model.Entity) else getattr(obj, 'modified', None)
+
+    return util.w3c_datetime_str(modified) if isinstance(modified, datetime) else ''
+
+
+def _jsonable_cache_key(entity, kwargs: dict) -> str:
+    """Get cache key of entity's JSONable representation
+
+    Modification times of referenced author, tags, images and localizations are part of the key, because their data is
+    embedded into the representation.
+
+    :type entity: Content
+    """
+    opts = sorted((k, repr(v)) for k, v in kwargs.items() if k != 'jsonable_refs')
+    opts_hash = hashlib.md5(repr(opts).encode()).hexdigest()
+    modified = util.w3c_datetime_str(entity.f_get('_modified'))
+
+    refs = []
+    for f_name in ['author', 'tags', 'images'] + ['localization_' + lng for lng in lang.langs()]:
+        if entity.has_field(f_name):
+            value = entity.f_get(f_name)
+            refs += [_modified_str(v) for v in (value if isinstance(value, (list, tuple)) else (value,)) if v]
+    refs_hash = hashlib.md5(repr(refs).encode()).hexdigest()
+
+    return '{}:{}:{}:{}:{}:{}:{}'.format(entity.model, entity.id, modified, refs_hash, lang.get_current(),
+                                         auth.get_current_user().uid, opts_hash)
+
+
 def _remove_tags(s: str) -> str:
     s = _body_img_tag_re.sub('', s)
     s = _body_vid_tag_re.sub('', s)
@@ -184,6 +243,30 @@ def _remove_tags(s: str) -> str:
     return s
 
 
+def _plain_text(s: str) -> str:
+    """Remove body tags and HTML from a string and collapse whitespaces
+    """
+    return _spaces_re.sub(' ', html_unescape(_html_tag_re.sub(' ', _remove_tags(s or '')))).strip()
+
+
+def _excerpt(text: str, length: int) -> str:
+    """Cut a plain text at word boundary
+    """
+    if len(text) <= length:
+        return text
+
+    return text[:length].rsplit(' ', 1)[0].rstrip(',.;:-') + '…'
+
+
+_BROWSER_LINK_TPL = '<a href="{}">{}</a>'
+_browser_local = threading.local()
+_BROWSER_BADGE_TPL = '<span class="label label-{} badge badge-{}">{}</span>'
+_BROWSER_IMAGES_TPL = (
+    '<span class="label label-default badge badge-secondary">{}</span>',
+    '<span class="label label-primary badge badge-primary">{}</span>',
+)
+
+
 class Content(odm_ui.model.UIEntity):
     """Base Content Model
     """
@@ -245,6 +328,30 @@ class Content(odm_ui.model.UIEntity):
         """
         return self.f_get('body', process_tags=True)
 
+    @property
+    def body_text(self) -> str:
+        """Plain text of the body getter
+        """
+        return self.f_get('body_text') or _plain_text(self.f_get('body', process_tags=False))
+
+    @property
+    def excerpt(self) -> str:
+        """Excerpt of the body getter
+        """
+        return self.f_get('excerpt') or _excerpt(self.body_text, reg.get('content.excerpt_length', 300))
+
+    @property
+    def word_count(self) -> int:
+        """Number of words of the body getter
+        """
+        return self.f_get('word_count') or len(self.body_text.split())
+
+    @property
+    def reading_time(self) -> int:
+        """Reading time of the body in minutes getter
+        """
+        return self.f_get('reading_time') or math.ceil(self.word_count / reg.get('content.reading_speed', 200))
+
     @property
     def images(self) -> Tuple[file.model.AbstractImage]:
         """Images getter
@@ -269,6 +376,12 @@ class Content(odm_ui.model.UIEntity):
         """
         return self.f_get('video_links')
 
+    @property
+    def video_meta(self) -> Tuple[dict]:
+        """Video links metadata getter
+        """
+        return self.f_get('video_meta')
+
     @property
     def views_count(self) -> int:
         """Views counter getter
@@ -311,6 +424,53 @@ class Content(odm_ui.model.UIEntity):
         """
         return self.f_get('options')
 
+    # Depth of nested saves of the entity and whether a deferred fast save is pending
+    _content_save_depth = 0
+    _content_save_pending = False
+
+    @_profiler.profiled('content.save')
+    def save(self, **kwargs):
+        """Save the entity
+
+        Fast saves of the entity made by hooks while it is being saved are coalesced into a single write, which is
+        performed after all hooks have finished.
+        """
+        if self._content_save_depth and kwargs.get('fast'):
+            self._content_save_pending = True
+            return self
+
+        is_logical_save_start = not getattr(_save_local, 'writes', None)
+        if is_logical_save_start:
+            _save_local.writes = [0]
+
+        self._content_save_depth += 1
+        try:
+            with _metrics.timer('content.save', is_logical_save_start):
+                super().save(**kwargs)
+                _save_local.writes[0] += 1
+                _metrics.count_op('writes')
+
+                if self._content_save_depth == 1 and self._content_save_pending:
+                    self._content_save_pending = False
+                    super().save(fast=True)
+                    _save_local.writes[0] += 1
+                    _metrics.count_op('writes')
+        finally:
+            self._content_save_depth -= 1
+            if not self._content_save_depth:
+                self._content_save_pending = False
+
+            if is_logical_save_start:
+                writes = _save_local.writes[0]
+                _save_local.writes = None
+                with _save_stats_lock:
+                    _save_stats['saves'] += 1
+                    _save_stats['writes'] += writes
+                _metrics.observe('content.save.entity_writes', writes)
+                logger.debug("Content entity '{}' saved with {} write(s)".format(self.ref, writes))
+
+        return self
+
     def _setup_fields(self, **kwargs):
         """Hook
         """
@@ -331,6 +491,7 @@ class Content(odm_ui.model.UIEntity):
         # Title
         if 'title' not in skip:
             self.define_field(odm.field.String('title', is_required=True))
+            self.define_field(odm.field.StringList('title_prefix_keys'))
 
         # Description
         if 'description' not in skip:
@@ -339,6 +500,10 @@ class Content(odm_ui.model.UIEntity):
         # Body
         if 'body' not in skip:
             self.define_field(odm.field.String('body', is_required=True, strip_html=False))
+            self.define_field(odm.field.String('body_text', strip_html=False))
+            self.define_field(odm.field.String('excerpt', strip_html=False))
+            self.define_field(odm.field.Integer('word_count'))
+            self.define_field(odm.field.Integer('reading_time'))
 
         # Images
         if 'images' not in skip:
@@ -355,6 +520,7 @@ class Content(odm_ui.model.UIEntity):
         # Video links
         if 'video_links' not in skip:
             self.define_field(odm.field.UniqueStringList('video_links'))
+            self.define_field(odm.field.List('video_meta'))
 
         # Views counter
         if 'views_count' not in skip:
@@ -392,6 +558,10 @@ class Content(odm_ui.model.UIEntity):
             if self.has_field(f):
                 self.define_index([(f, odm.I_ASC)])
 
+        # Title autocompletion index
+        if self.has_field('title_prefix_keys'):
+            self.define_index([('language', odm.I_ASC), ('title_prefix_keys', odm.I_ASC)])
+
         # Text index
         text_index_parts = []
         for f in 'title', 'description', 'body':
@@ -431,6 +601,10 @@ class Content(odm_ui.model.UIEntity):
             else:
                 self.f_set('language_db', 'none')
 
+        elif field_name == 'title' and self.has_field('title_prefix_keys'):
+            from . import _autocomplete
+            self.f_set('title_prefix_keys', _autocomplete.title_prefix_keys(value))
+
         elif field_name == 'status':
             if value not in self.content_statuses():
                 raise ValueError("'{}' is invalid content status for model '{}'".format(value, self.model))
@@ -438,6 +612,7 @@ class Content(odm_ui.model.UIEntity):
 
         return super()._on_f_set(field_name, value, **kwargs)
 
+    @_metrics.timed('content.on_pre_save')
     def _on_pre_save(self, **kwargs):
         """Hook
         """
@@ -482,9 +657,24 @@ class Content(odm_ui.model.UIEntity):
                 self.f_set('body', body)
                 self.f_set('video_links', list(self.video_links) + video_links)
 
+        # Plain text derivatives of the body
+        if self.has_field('body_text') and (self.f_is_modified('body') or not self.f_get('body_text')):
+            text = _plain_text(self.f_get('body', process_tags=False))
+            word_count = len(text.split())
+            self.f_set('body_text', text)
+            self.f_set('excerpt', _excerpt(text, reg.get('content.excerpt_length', 300)))
+            self.f_set('word_count', word_count)
+            self.f_set('reading_time', math.ceil(word_count / reg.get('content.reading_speed', 200)))
+
+        # Resolve video links metadata
+        if self.has_field('video_meta') and (self.f_is_modified('video_links') or
+                                             len(self.video_meta) != len(self.video_links)):
+            self.f_set('video_meta', [_render.resolve_video_meta(link) for link in self.video_links])
+
         events.fire('content@entity.pre_save', entity=self)
         events.fire('content@entity.{}.pre_save.'.format(self.model), entity=self)
 
+    @_metrics.timed('content.on_after_save')
     def _on_after_save(self, first_save: bool = False, **kwargs):
         """Hook
         """
@@ -532,6 +722,7 @@ class Content(odm_ui.model.UIEntity):
         events.fire('content@entity.save', entity=self)
         events.fire('content@entity.{}.save'.format(self.model), entity=self)
 
+    @_metrics.timed('content.on_pre_delete')
     def _on_pre_delete(self, **kwargs):
         """Hook
         """
@@ -544,14 +735,20 @@ class Content(odm_ui.model.UIEntity):
         finally:
             auth.restore_user()
 
+    @_metrics.timed('content.on_after_delete')
     def _on_after_delete(self, **kwargs):
         """Hook
         """
+        _metrics.count_op('writes')
+
         # Delete all attached images
         if self.has_field('images'):
             for img in self.images:
                 img.delete()
 
+        events.fire('content@entity.delete', entity=self)
+        events.fire('content@entity.{}.delete'.format(self.model), entity=self)
+
     @classmethod
     def odm_auth_permissions_group(cls) -> str:
         """Hook
@@ -575,18 +772,35 @@ class Content(odm_ui.model.UIEntity):
 
         return r
 
+    def content_check_model_permission(self, perm: str, user: auth.AbstractUser = None) -> bool:
+        """Check model level permission using decisions cache
+        """
+        user = user or auth.get_current_user()
+
+        return _perm_cache.model_decision(user, self.model, perm,
+                                          lambda: self.odm_auth_check_model_permissions(self.model, perm, user))
+
     def odm_auth_check_entity_permissions(self, perm: Union[str, List[str]], user: auth.AbstractUser = None) -> bool:
         """Hook
         """
         user = user or auth.get_current_user()
 
+        # Decision depends on entity's ownership and status only
+        owner = self.f_get('author') if self.has_field('author') else None
+        status = self.status if self.has_field('status') else None
+        key = (self.model, perm if isinstance(perm, str) else tuple(perm), self.is_new, owner.uid if owner else None,
+               status, self.has_field('status') and self.f_is_modified('status'))
+
+        return _perm_cache.entity_decision(user, key, lambda: self._content_check_entity_permissions(perm, user))
+
+    def _content_check_entity_permissions(self, perm: Union[str, List[str]], user: auth.AbstractUser) -> bool:
         # Content should not be modified by author until it's waiting for moderation
         if perm == 'modify' \
                 and self.has_field('status') \
                 and self.status == CONTENT_STATUS_WAITING \
                 and not self.f_is_modified('status') \
-                and not self.odm_auth_check_model_permissions(self.model, CONTENT_PERM_BYPASS_MODERATION, user) \
-                and not self.odm_auth_check_model_permissions(self.model, perm, user):
+                and not self.content_check_model_permission(CONTENT_PERM_BYPASS_MODERATION, user) \
+                and not self.content_check_model_permission(perm, user):
             return False
 
         return super().odm_auth_check_entity_permissions(perm, user)
@@ -614,7 +828,7 @@ class Content(odm_ui.model.UIEntity):
             browser.insert_data_field('images', 'content@images')
 
         # Author (visible only if current user has permission to modify any entity)
-        if self.has_field('author') and self.odm_auth_check_model_permissions(self.model, PERM_MODIFY):
+        if self.has_field('author') and self.content_check_model_permission(PERM_MODIFY):
             browser.insert_data_field('author', 'content@author')
 
         # Publish time
@@ -626,43 +840,115 @@ class Content(odm_ui.model.UIEntity):
 
         finder.eq('language', lang.get_current())
 
+        # Browser renders rows one by one, so the finder is kept to fetch URLs of the whole page at the first row
+        context = self._content_browser_context()
+        context['finder'] = finder
+        context['limit'] = int(args.get('limit') or 0)
+
     def odm_ui_browser_row(self) -> dict:
         """Hook
         """
-        r = {}
+        return self.odm_ui_browser_rows([self])[0]
 
-        # Title
+    def odm_ui_browser_rows(self, entities: List['Content']) -> List[dict]:
+        """Hook
+
+        Renders browser's rows of multiple entities, fetching their URLs in bulk. When rows are requested one by one,
+        URLs of the whole page are fetched at the first row using the browser's finder. Permissions, status badges and
+        authors' names do not depend on entities, they are evaluated once per request.
+        """
+        context = self._content_browser_context()
+
+        urls = {}  # type: Dict[str, str]
         if self.has_field('title'):
-            r['title'] = (str(htmler.A(self.title, href=self.url)) if self.url else self.title)
+            if context.get('finder') is not None and 'urls' not in context:
+                context['urls'] = self.content_browser_urls(list(context['finder'].get(context['limit'])))
+            urls = context.get('urls', {})
+
+            # Entities which are not on the browser's page
+            missing = [e for e in entities if e.id not in urls]
+            if missing:
+                urls = dict(urls, **self.content_browser_urls(missing))
+
+        rows = []
+        for entity in entities:
+            r = {}
+
+            # Title
+            if self.has_field('title'):
+                url = urls.get(entity.id)
+                title = util.escape_html(entity.title)
+                r['title'] = _BROWSER_LINK_TPL.format(util.escape_html(url), title) if url else title
+
+            # Status
+            if self.has_field('status'):
+                r['status'] = context['status_badges'].get(entity.status, entity.status)
+
+            # Images, counted without fetching them
+            if self.has_field('images'):
+                images_count = len(entity.get_field('images').get_storable_val() or ())
+                r['images'] = _BROWSER_IMAGES_TPL[bool(images_count)].format(images_count)
+
+            # Author, each one is fetched once per request
+            if context['show_author']:
+                authors = context['authors']
+                author_uid = entity.get_field('author').get_storable_val()
+                if author_uid not in authors:
+                    authors[author_uid] = util.escape_html(entity.author.first_last_name) if entity.author \
+                        else '&nbsp;'
+                r['author'] = authors[author_uid]
+
+            # Publish time
+            if self.has_field('publish_time'):
+                r['publish_time'] = entity.f_get('publish_time', fmt='%d.%m.%Y %H:%M')
+
+            rows.append(r)
+
+        return rows
+
+    def _content_browser_context(self) -> dict:
+        """Get data shared by all browser's rows of the model within current request
+        """
+        contexts = None
+        request = router.request()
+        if request is not None:
+            if getattr(_browser_local, 'request', None) is not request:
+                _browser_local.request = request
+                _browser_local.contexts = {}
+            contexts = _browser_local.contexts
+            key = (self.model, auth.get_current_user().uid)
+            if key in contexts:
+                return contexts[key]
+
+        context = {
+            'status_badges': self._content_status_badges() if self.has_field('status') else {},
+            'show_author': self.has_field('author') and self.content_check_model_permission(PERM_MODIFY),
+            'authors': {},
+        }
+
+        if contexts is not None:
+            contexts[key] = context
+
+        return context
+
+    def content_browser_urls(self, entities: List['Content']) -> Dict[str, str]:
+        """Get URLs of multiple entities
+        """
+        return {entity.id: entity.url for entity in entities}
 
-        # Status
-        if self.has_field('status'):
-            status = self.status
-            status_str = self.t('content_status_{}_{}'.format(self.model, status))
+    def _content_status_badges(self) -> Dict[str, str]:
+        """Get HTML code of badges of all model's statuses
+        """
+        r = {}
+        for status in self.content_statuses():
             label_css = badge_css = 'primary'
             if status == CONTENT_STATUS_WAITING:
                 label_css = badge_css = 'warning'
             elif status == CONTENT_STATUS_UNPUBLISHED:
                 label_css = 'default'
                 badge_css = 'secondary'
-            status = str(htmler.Span(status_str, css='label label-{} badge badge-{}'.format(label_css, badge_css)))
-            r['status'] = status
-
-        # Images
-        if self.has_field('images'):
-            label_css = 'default' if not len(self.images) else 'primary'
-            badge_css = 'secondary' if not len(self.images) else 'primary'
-            images_count = '<span class="label label-{} badge badge-{}">{}</span>'. \
-                format(label_css, badge_css, len(self.images))
-            r['images'] = images_count
-
-        # Author
-        if self.has_field('author') and self.odm_auth_check_model_permissions(self.model, PERM_MODIFY):
-            r['author'] = self.author.first_last_name if self.author else '&nbsp;'
-
-        # Publish time
-        if self.has_field('publish_time'):
-            r['publish_time'] = self.f_get('publish_time', fmt='%d.%m.%Y %H:%M')
+            status_str = self.t('content_status_{}_{}'.format(self.model, status))
+            r[status] = _BROWSER_BADGE_TPL.format(label_css, badge_css, status_str)
 
         return r
 
@@ -807,6 +1093,25 @@ class Content(odm_ui.model.UIEntity):
                 required=True,
             ))
 
+    def odm_ui_browser_mass_action_buttons(self) -> List[dict]:
+        """Hook
+        """
+        r = []
+
+        if not self.has_field('status') or not self.content_check_model_permission(PERM_MODIFY):
+            return r
+
+        for status in self.content_statuses():
+            r.append({
+                'rule': 'content@set_status',
+                'args': {'model': self.model, 'status': status},
+                'title': self.t('content_status_{}_{}'.format(self.model, status)),
+                'icon': 'fa fas fa-flag',
+                'color': 'warning' if status == CONTENT_STATUS_WAITING else 'default',
+            })
+
+        return r
+
     def odm_ui_mass_action_entity_description(self) -> str:
         """Hook
         """
@@ -815,11 +1120,14 @@ class Content(odm_ui.model.UIEntity):
     def odm_ui_widget_select_search_entities(self, f: odm.MultiModelFinder, args: dict):
         """Hook
         """
-        f.eq('language', args.get('language', lang.get_current()))
+        from . import _autocomplete
+
+        language = args.get('language', lang.get_current())
+        f.eq('language', language)
 
         query = args.get('q')
         if query:
-            f.regex('title', query, True)
+            _autocomplete.apply(f, self.model, query, language)
 
     def odm_ui_widget_select_search_entities_is_visible(self, args: dict) -> bool:
         """Hook
@@ -835,12 +1143,14 @@ class Content(odm_ui.model.UIEntity):
     def odm_http_api_get_entities(cls, finder: odm.SingleModelFinder, args: routing.ControllerArgs):
         """Called by 'odm_http_api@get_entities' route
         """
+        from . import _search, _autocomplete
+
         if 'search' in args:
             query = args['search']
-            if args.get('search_by') == 'title' and finder.mock.has_field('title'):
-                finder.regex('title', query)
+            if args.get('search_by') == 'title' and finder.mock.has_field('title_prefix_keys'):
+                _autocomplete.apply_regex(finder, query)
             else:
-                finder.text(query, lang.get_current())
+                _search.get_engine().apply(finder, query, lang.get_current())
 
     @classmethod
     def content_statuses(cls) -> List[str]:
@@ -896,6 +1206,10 @@ class Content(odm_ui.model.UIEntity):
                 self.publish_time < now:
             self.f_set('publish_time', now).save(fast=True)
 
+        # Notify about entity's publication, scheduled publications are notified by scheduler
+        if self.status == CONTENT_STATUS_PUBLISHED and self.publish_time <= now:
+            events.fire('content@entity.published', entity=self)
+
         if reg.get('content.waiting_status_admin_notification', True):
             self._content_notify_admins_waiting_status()
 
@@ -904,11 +1218,37 @@ class Content(odm_ui.model.UIEntity):
 
     def as_jsonable(self, **kwargs) -> dict:
         """Get JSONable representation of the entity
+
+        Supported kwargs: `fields` and `exclude` (a list or a comma separated string of top level keys),
+        `localizations_depth` (how deep localizations should be serialized, 1 by default),
+        `images_thumb_width`, `images_thumb_height` and `jsonable_refs` (a dict shared between entities being
+        serialized together, see `content.as_jsonable_bulk()`).
+        """
+        cache_ttl = reg.get('content.jsonable_cache_ttl', 300)
+        if self.is_new or not cache_ttl:
+            return self._content_as_jsonable(**kwargs)
+
+        pool = cache.get_pool('content@jsonable')
+        cache_key = _jsonable_cache_key(self, kwargs)
+        try:
+            return dict(pool.get(cache_key))
+        except cache.error.KeyNotExist:
+            r = self._content_as_jsonable(**kwargs)
+            pool.put(cache_key, r, cache_ttl)
+
+            return dict(r)
+
+    def _content_as_jsonable(self, **kwargs) -> dict:
+        """Build JSONable representation of the entity
         """
         r = super().as_jsonable()
+        want = _jsonable_field_filter(kwargs)
+        refs = kwargs.get('jsonable_refs')
+        if refs is None:
+            refs = kwargs['jsonable_refs'] = {}
 
         # Publish time
-        if self.has_field('publish_time'):
+        if self.has_field('publish_time') and want('publish_time'):
             r['publish_time'] = {
                 'w3c': util.w3c_datetime_str(self.publish_time),
                 'pretty_date': self.publish_date_pretty,
@@ -917,34 +1257,46 @@ class Content(odm_ui.model.UIEntity):
             }
 
         # Author
-        if self.has_field('author') and self.author.is_public:
-            r['author'] = self.author.as_jsonable()
+        if self.has_field('author') and want('author') and self.author.is_public:
+            author_key = 'author:' + self.author.uid
+            if author_key not in refs:
+                refs[author_key] = self.author.as_jsonable()
+            r['author'] = refs[author_key]
 
         # Language
-        if self.has_field('language'):
+        if self.has_field('language') and want('language'):
             r['language'] = self.language
 
         # Localizations
-        for lng in lang.langs():
-            if self.has_field('localization_' + lng):
-                ref = self.f_get('localization_' + lng)
-                if ref:
-                    r['localization_' + lng] = ref.as_jsonable(**kwargs)
+        depth = int(kwargs.get('localizations_depth', 1))
+        if depth > 0:
+            for lng in lang.langs():
+                f_name = 'localization_' + lng
+                if self.has_field(f_name) and want(f_name):
+                    ref = self.f_get(f_name)
+                    if ref:
+                        r[f_name] = ref.as_jsonable(**dict(kwargs, localizations_depth=depth - 1))
 
         # Title
-        if self.has_field('title'):
+        if self.has_field('title') and want('title'):
             r['title'] = self.title
 
         # Description
-        if self.has_field('description'):
+        if self.has_field('description') and want('description'):
             r['description'] = self.description
 
         # Body
-        if self.has_field('body'):
+        if self.has_field('body') and want('body'):
             r['body'] = self.body
 
+        # Body plain text derivatives
+        if self.has_field('body_text'):
+            for k in 'excerpt', 'word_count', 'reading_time':
+                if want(k):
+                    r[k] = getattr(self, k)
+
         # Images
-        if self.has_field('images'):
+        if self.has_field('images') and (want('images') or want('thumbnail')):
             thumb_w = kwargs.get('images_thumb_width', 500)
             thumb_h = kwargs.get('images_thumb_height', 500)
 
@@ -952,45 +1304,57 @@ class Content(odm_ui.model.UIEntity):
                 'thumb_width': thumb_w,
                 'thumb_height': thumb_h,
             }
-            r['images'] = [img.as_jsonable(**img_jsonable_args) for img in self.images]
+            images = self.images
 
-            if self.images:
-                r['thumbnail'] = self.images[0].get_url(width=thumb_w, height=thumb_h)
+            if want('images'):
+                r['images'] = [img.as_jsonable(**img_jsonable_args) for img in images]
+
+            if images and want('thumbnail'):
+                r['thumbnail'] = images[0].get_url(width=thumb_w, height=thumb_h)
 
         # Tags
-        if self.has_field('tags'):
-            r['tags'] = [t.as_jsonable() for t in self.tags]
+        if self.has_field('tags') and want('tags'):
+            r['tags'] = []
+            for t in self.tags:
+                tag_key = 'tag:' + t.id
+                if tag_key not in refs:
+                    refs[tag_key] = t.as_jsonable()
+                r['tags'].append(refs[tag_key])
 
         # External links
-        if self.has_field('ext_links'):
+        if self.has_field('ext_links') and want('ext_links'):
             r['ext_links'] = self.ext_links
 
         # Video links
-        if self.has_field('video_links'):
+        if self.has_field('video_links') and want('video_links'):
             r['video_links'] = self.video_links
 
+        # Video links metadata
+        if self.has_field('video_meta') and want('video_meta'):
+            r['video_meta'] = self.video_meta
+
         # Views counter
-        if self.has_field('views_count'):
+        if self.has_field('views_count') and want('views_count'):
             r['views_count'] = self.views_count
 
         # Comments counter
-        if self.has_field('comments_count'):
+        if self.has_field('comments_count') and want('comments_count'):
             r['comments_count'] = self.comments_count
 
         # Likes counter
-        if self.has_field('likes_count'):
+        if self.has_field('likes_count') and want('likes_count'):
             r['likes_count'] = self.likes_count
 
         # Bookmarks counter
-        if self.has_field('bookmarks_count'):
+        if self.has_field('bookmarks_count') and want('bookmarks_count'):
             r['bookmarks_count'] = self.bookmarks_count
 
         # Status
-        if self.has_field('status'):
+        if self.has_field('status') and want('status'):
             r['status'] = self.status
 
         # Options
-        if self.has_field('options'):
+        if self.has_field('options') and want('options'):
             r['options'] = dict(self.options)
 
         return r
@@ -1030,14 +1394,13 @@ class ContentWithURL(Content):
 
             # Entity doesn't have attached route alias reference
             if not self.route_alias:
-                # Route target cannot be built while entity is not saved,
-                # so route alias needs to be saved temporary as a string
+                # Route alias string may depend on fields which are not set yet,
+                # so route alias is created right before the first save
                 if self.is_new:
                     self.f_set('tmp_route_alias_str', value)
                     value = None
                 else:
-                    target = router.rule_path('content@view', {'model': self.model, 'eid': self.id})
-                    value = route_alias.create(route_alias_str, target, self.language).save()
+                    value = route_alias.create(route_alias_str, self.content_route_target(), self.language).save()
             else:
                 # Existing route alias needs to be changed
                 if self.route_alias.alias != route_alias_str:
@@ -1046,15 +1409,70 @@ class ContentWithURL(Content):
 
         return super()._on_f_set(field_name, value, **kwargs)
 
+    def content_preallocate_id(self) -> str:
+        """Get ID of the entity, allocating it before the first save if necessary
+        """
+        if self.is_new and not self.f_get('_id'):
+            self.f_set('_id', ObjectId())
+
+        return str(self.f_get('_id'))
+
+    def content_route_target(self) -> str:
+        """Get route alias target path
+        """
+        return router.rule_path('content@view', {'model': self.model, 'eid': self.content_preallocate_id()})
+
+    # Route alias created right before the first save and the string it was created from
+    _content_new_route_alias = None  # type: Optional[Tuple[route_alias.model.RouteAlias, str]]
+
+    def save(self, **kwargs):
+        """Save the entity
+
+        Route alias created for a new entity is removed if the entity cannot be inserted.
+        """
+        try:
+            return super().save(**kwargs)
+        except Exception:
+            if self._content_new_route_alias and self.is_new:
+                r_alias, tmp_route_alias_str = self._content_new_route_alias
+                self._content_new_route_alias = None
+                self.f_set('route_alias', None).f_set('tmp_route_alias_str', tmp_route_alias_str)
+                try:
+                    r_alias.delete()
+                except Exception as e:
+                    logger.error(e)
+            raise
+
+    @_metrics.timed('content.with_url.on_pre_save')
+    def _on_pre_save(self, **kwargs):
+        """Hook
+        """
+        super()._on_pre_save(**kwargs)
+
+        # Route alias is created using pre-allocated ID, so the entity is inserted once and is never stored without URL
+        if self.is_new and not self.route_alias:
+            tmp_route_alias_str = self.f_get('tmp_route_alias_str')
+            alias_str = self.content_alter_route_alias_str((tmp_route_alias_str or '').strip())
+            r_alias = route_alias.create(alias_str, self.content_route_target(), self.language).save()
+            self.f_set('route_alias', r_alias).f_rst('tmp_route_alias_str')
+            self._content_new_route_alias = (r_alias, tmp_route_alias_str)
+
+    @_metrics.timed('content.with_url.on_after_save')
     def _on_after_save(self, first_save: bool = False, **kwargs):
         """Hook
         """
         super()._on_after_save(first_save, **kwargs)
+        self._content_new_route_alias = None
 
         # Auto-generate a route alias
         if not self.route_alias:
             self.f_set('route_alias', self.f_get('tmp_route_alias_str')).f_rst('tmp_route_alias_str').save(fast=True)
 
+        # Pre-allocated ID has been replaced while inserting
+        elif first_save and self.route_alias.target != self.content_route_target():
+            self.route_alias.f_set('target', self.content_route_target()).save()
+
+    @_metrics.timed('content.with_url.on_after_delete')
     def _on_after_delete(self, **kwargs):
         """Hook
         """
@@ -1094,6 +1512,24 @@ class ContentWithURL(Content):
 
         return router.url(target_path, lang=self.language)
 
+    def content_browser_urls(self, entities: List['Content']) -> Dict[str, str]:
+        """Hook
+
+        Route aliases of all entities are fetched by a single query.
+        """
+        targets = {}
+        for entity in entities:
+            target_path = router.url(super(ContentWithURL, entity).odm_ui_view_url(), add_lang_prefix=False,
+                                     as_list=True)[2]
+            targets[entity.id] = (target_path, entity.language)
+
+        aliases = {}
+        if targets:
+            for r_alias in odm.find('route_alias').inc('target', [t[0] for t in targets.values()]).get():
+                aliases[(r_alias.f_get('target'), r_alias.f_get('language'))] = r_alias.f_get('alias')
+
+        return {eid: router.url(aliases.get(target, target[0]), lang=target[1]) for eid, target in targets.items()}
+
     def odm_ui_m_form_setup_widgets(self, frm: form.Form):
         """Hook
         """
@@ -1127,11 +1563,12 @@ class ContentWithURL(Content):
 
         return orig_str
 
-    def as_jsonable(self, **kwargs):
-        """Get JSONable representation of the entity
+    def _content_as_jsonable(self, **kwargs) -> dict:
+        """Build JSONable representation of the entity
         """
-        r = super().as_jsonable(**kwargs)
+        r = super()._content_as_jsonable(**kwargs)
 
-        r['url'] = self.url
+        if _jsonable_field_filter(kwargs)('url'):
+            r['url'] = self.url
 
         return r
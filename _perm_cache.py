@@ -0,0 +1,102 @@
+"""PytSite Content Plugin Permission Decisions Cache
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import threading
+from time import monotonic
+from typing import Callable, Dict, Hashable, Optional, Tuple
+from pytsite import reg, router
+from plugins import auth
+from . import _metrics
+
+_local = threading.local()
+_roles_cache = {}  # type: Dict[Hashable, Tuple[float, bool]]
+_roles_cache_lock = threading.Lock()
+_ROLES_CACHE_MAX_SIZE = 10000
+
+
+def _user_key(user: auth.AbstractUser) -> tuple:
+    """Key of a user which changes when user's roles change
+    """
+    return user.uid, tuple(sorted(role.uid for role in user.roles))
+
+
+def _request_cache() -> Optional[dict]:
+    """Get decisions cache of current request
+
+    Returns None outside of a request, i. e. in console.
+    """
+    request = router.request()
+    if request is None:
+        return None
+
+    if getattr(_local, 'request', None) is not request:
+        _local.request = request
+        _local.decisions = {}
+
+    return _local.decisions
+
+
+def model_decision(user: auth.AbstractUser, model: str, perm: str, resolver: Callable[[], bool]) -> bool:
+    """Get cached model level permission decision
+
+    Decisions are cached for the current request and for `content.perm_cache_ttl` seconds per user's roles set.
+    """
+    key = ('model', _user_key(user), model, perm)
+
+    request_cache = _request_cache()
+    if request_cache is not None and key in request_cache:
+        _metrics.incr('content.perm_cache.hits')
+        return request_cache[key]
+
+    now = monotonic()
+    cached = _roles_cache.get(key)
+    if cached and cached[0] > now:
+        _metrics.incr('content.perm_cache.hits')
+        decision = cached[1]
+    else:
+        _metrics.incr('content.perm_cache.misses')
+        decision = resolver()
+        ttl = reg.get('content.perm_cache_ttl', 10)
+        if ttl:
+            with _roles_cache_lock:
+                if len(_roles_cache) >= _ROLES_CACHE_MAX_SIZE:
+                    _roles_cache.clear()
+                _roles_cache[key] = (now + ttl, decision)
+
+    if request_cache is not None:
+        request_cache[key] = decision
+
+    return decision
+
+
+def entity_decision(user: auth.AbstractUser, key: tuple, resolver: Callable[[], bool]) -> bool:
+    """Get cached entity level permission decision
+
+    Key should contain everything a decision depends on except user, i. e. model, permission, ownership and status.
+    Decisions are cached for the current request only.
+    """
+    request_cache = _request_cache()
+    if request_cache is None:
+        return resolver()
+
+    key = ('entity', _user_key(user)) + key
+    if key in request_cache:
+        _metrics.incr('content.perm_cache.hits')
+        return request_cache[key]
+
+    _metrics.incr('content.perm_cache.misses')
+    decision = request_cache[key] = resolver()
+
+    return decision
+
+
+def clear():
+    """Clear all cached decisions
+    """
+    with _roles_cache_lock:
+        _roles_cache.clear()
+
+    _local.__dict__.clear()
@@ -0,0 +1,207 @@
+"""PytSite Content Plugin Sampling Profiler
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import sys
+import json
+import threading
+from os import path, makedirs, listdir, unlink
+from time import perf_counter, sleep, time
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+from pytsite import reg, logger
+
+_enabled = False
+_sessions = {}  # type: Dict[int, _Session]
+_sessions_lock = threading.Lock()
+_sampler_thread = None  # type: Optional[threading.Thread]
+
+
+class _Session:
+    """Profiling session of a single call
+    """
+
+    def __init__(self, target: str):
+        self.target = target
+        self.started = datetime.now()
+        self.samples = {}  # type: Dict[tuple, int]
+        self.queries = []  # type: List[dict]
+
+    def add_sample(self, frame):
+        stack = []
+        while frame:
+            code = frame.f_code
+            stack.append('{}:{}:{}'.format(code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+
+        stack = tuple(reversed(stack))
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+
+def _sampler():
+    """Sample stacks of threads executing profiled calls
+    """
+    global _sampler_thread
+
+    interval = reg.get('content.profiler_interval', 5) / 1000
+
+    while True:
+        with _sessions_lock:
+            if not _sessions:
+                _sampler_thread = None
+                return
+
+            frames = sys._current_frames()
+            for thread_id, session in _sessions.items():
+                if thread_id in frames:
+                    session.add_sample(frames[thread_id])
+
+        sleep(interval)
+
+
+def _reports_dir() -> str:
+    return path.join(reg.get('paths.log'), 'content-profiler')
+
+
+def _write_report(session: _Session, duration: float):
+    """Write a report and remove old ones
+    """
+    reports_dir = _reports_dir()
+    if not path.exists(reports_dir):
+        makedirs(reports_dir, 0o755, True)
+
+    top_stacks = sorted(session.samples.items(), key=lambda x: x[1], reverse=True)[:20]
+    report = {
+        'target': session.target,
+        'started': session.started.isoformat(),
+        'duration_ms': duration,
+        'samples': [{'count': count, 'stack': list(stack)} for stack, count in top_stacks],
+        'queries': session.queries,
+    }
+
+    file_name = '{}-{}-{}.json'.format(int(time() * 1000), session.target, threading.get_ident())
+    with open(path.join(reports_dir, file_name), 'wt', encoding='utf-8') as f:
+        json.dump(report, f)
+
+    logger.warning("Slow call of '{}' took {:.0f} ms, profiling report saved to '{}'".
+                format(session.target, duration, file_name))
+
+    # Rotate reports
+    reports = sorted(listdir(reports_dir))
+    for file_name in reports[:max(len(reports) - reg.get('content.profiler_max_reports', 100), 0)]:
+        unlink(path.join(reports_dir, file_name))
+
+
+def configure():
+    """Enable or disable profiler according to `content.profiler_enabled` registry option
+    """
+    global _enabled
+
+    _enabled = reg.get('content.profiler_enabled', False)
+
+
+def is_profiling() -> bool:
+    """Check if a call is being profiled in current thread
+    """
+    return threading.get_ident() in _sessions
+
+
+def record_query(command: str, collection: str, query_filter: str, duration_ms: float, result: str):
+    """Add a query to the session of current thread
+    """
+    session = _sessions.get(threading.get_ident())
+    if session:
+        session.queries.append({
+            'command': command,
+            'collection': collection,
+            'filter': query_filter[:500],
+            'duration_ms': duration_ms,
+            'result': result,
+        })
+
+
+def profiled(target: str) -> Callable:
+    """Decorator which profiles a function call and saves a report if the call is slow
+
+    Nested profiled calls are profiled as part of the outermost one.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            global _sampler_thread
+
+            thread_id = threading.get_ident()
+            if not _enabled or thread_id in _sessions:
+                return func(*args, **kwargs)
+
+            session = _Session(target)
+            with _sessions_lock:
+                _sessions[thread_id] = session
+                if not _sampler_thread:
+                    _sampler_thread = threading.Thread(target=_sampler, name='content-profiler', daemon=True)
+                    _sampler_thread.start()
+
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = (perf_counter() - start) * 1000
+                with _sessions_lock:
+                    del _sessions[thread_id]
+
+                if duration >= reg.get('content.profiler_threshold', 1000):
+                    try:
+                        _write_report(session, duration)
+                    except OSError as e:
+                        logger.error(e)
+
+        return wrapper
+
+    return decorator
+
+
+def summarize(limit: int = 10) -> List[dict]:
+    """Summarize saved reports grouped by target, slowest targets first
+    """
+    reports_dir = _reports_dir()
+    if not path.exists(reports_dir):
+        return []
+
+    targets = {}  # type: Dict[str, dict]
+    for file_name in listdir(reports_dir):
+        try:
+            with open(path.join(reports_dir, file_name), encoding='utf-8') as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        t = targets.setdefault(report['target'], {
+            'target': report['target'],
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'queries': 0,
+            'frames': {},
+        })
+        t['count'] += 1
+        t['total_ms'] += report['duration_ms']
+        t['max_ms'] = max(t['max_ms'], report['duration_ms'])
+        t['queries'] += len(report['queries'])
+
+        # Count samples of the deepest frames
+        for sample in report['samples']:
+            if sample['stack']:
+                frame = sample['stack'][-1]
+                t['frames'][frame] = t['frames'].get(frame, 0) + sample['count']
+
+    r = []
+    for t in targets.values():
+        t['avg_ms'] = t['total_ms'] / t['count']
+        t['top_frames'] = sorted(t.pop('frames').items(), key=lambda x: x[1], reverse=True)[:limit]
+        r.append(t)
+
+    return sorted(r, key=lambda x: x['total_ms'], reverse=True)[:limit]
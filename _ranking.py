@@ -0,0 +1,320 @@
+"""PytSite Content Plugin Ranking Lists
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from pymongo import UpdateOne, DESCENDING
+from pytsite import mongodb, cache, reg, lang, logger
+from . import _api
+from ._model import Content
+
+_SCORES_COLLECTION_NAME = 'content_ranking_scores'
+_LISTS_COLLECTION_NAME = 'content_ranking_lists'
+
+# Scores are stored as logarithms of sums of exponentially weighted events times counted from this moment. Order of
+# such values does not change over time, so they can be indexed and updated without recalculating decay.
+_EPOCH = datetime(2020, 1, 1)
+
+METRICS = ('views', 'comments', 'likes', 'trending')
+
+_pending = {}  # type: Dict[Tuple[str, str, str, str], Tuple[Dict[str, float], datetime]]
+_pending_lock = threading.Lock()
+_last_flush = datetime.now()
+_flush_thread = None  # type: Optional[threading.Thread]
+_indexes_created = False
+
+
+def _windows() -> Dict[str, int]:
+    """Get windows' names and lengths in seconds
+    """
+    return reg.get('content.ranking_windows', {'24h': 86400, '7d': 604800, '30d': 2592000})
+
+
+def _trending_weights() -> Dict[str, float]:
+    return reg.get('content.ranking_trending_weights', {'views': 1.0, 'comments': 5.0, 'likes': 3.0})
+
+
+def _flush_size() -> int:
+    return reg.get('content.ranking_flush_size', 1000)
+
+
+def _flush_interval() -> int:
+    return reg.get('content.ranking_flush_interval', 60)
+
+
+def _list_length() -> int:
+    return reg.get('content.ranking_length', 100)
+
+
+def _score_field(metric: str, window: str) -> str:
+    return '{}_{}'.format(metric, window)
+
+
+def _scores():
+    global _indexes_created
+
+    collection = mongodb.get_collection(_SCORES_COLLECTION_NAME)
+    if not _indexes_created:
+        collection.create_index([('model', 1), ('eid', 1)])
+        for metric in METRICS:
+            for window in _windows():
+                collection.create_index([('model', 1), ('lng', 1), (_score_field(metric, window), DESCENDING)])
+        _indexes_created = True
+
+    return collection
+
+
+def _lists():
+    return mongodb.get_collection(_LISTS_COLLECTION_NAME)
+
+
+def _log_add_exp(a: float, b: float) -> float:
+    """Calculate log(exp(a) + exp(b)) without overflow
+    """
+    return max(a, b) + math.log1p(math.exp(-abs(a - b)))
+
+
+def _log_add_exp_expr(field: str, value: float) -> dict:
+    """Aggregation expression of `_log_add_exp()` for a document's field
+    """
+    current = '$' + field
+
+    return {'$cond': [
+        {'$eq': [{'$type': current}, 'missing']},
+        value,
+        {'$add': [
+            {'$max': [current, value]},
+            {'$ln': {'$add': [1, {'$exp': {'$multiply': [-1, {'$abs': {'$subtract': [current, value]}}]}}]}},
+        ]},
+    ]}
+
+
+def _decayed(score: float, window_len: int, now: datetime) -> float:
+    """Convert stored score to decayed events count at a moment
+    """
+    return math.exp(score - (now - _EPOCH).total_seconds() / window_len)
+
+
+def hit(entity: Content, metric: str, weight: float = 1.0):
+    """Register an event of an entity
+
+    Events are aggregated in memory and written by `flush()`, which is called by cron and in background when number of
+    aggregated scores or time since the last flush exceed limits, so processes without cron write events too. Each
+    window decays events exponentially with time constant equal to window's length.
+    """
+    if metric not in METRICS or metric == 'trending':
+        raise ValueError("Invalid ranking metric: '{}'".format(metric))
+
+    now = datetime.now()
+    t = (now - _EPOCH).total_seconds()
+    lng = entity.f_get('language') if entity.has_field('language') else ''
+    windows = _windows()
+
+    events = [(metric, weight)]
+    if _trending_weights().get(metric):
+        events.append(('trending', weight * _trending_weights()[metric]))
+
+    with _pending_lock:
+        for m, w in events:
+            key = (entity.model, entity.id, lng, m)
+            scores = _pending[key][0] if key in _pending else {}
+            for window, window_len in windows.items():
+                score = math.log(w) + t / window_len
+                scores[window] = _log_add_exp(scores[window], score) if window in scores else score
+            _pending[key] = (scores, now)
+
+        flush_needed = len(_pending) >= _flush_size() or (now - _last_flush).total_seconds() >= _flush_interval()
+
+    if flush_needed:
+        _flush_in_background()
+
+
+def _flush_in_background():
+    """Start a thread flushing aggregated events unless it is already running
+    """
+    global _flush_thread
+
+    def target():
+        global _flush_thread
+
+        try:
+            flush()
+        except Exception as e:
+            logger.error(e)
+        finally:
+            _flush_thread = None
+
+    with _pending_lock:
+        if _flush_thread:
+            return
+        _flush_thread = threading.Thread(target=target, name='content-ranking-flush', daemon=True)
+
+    _flush_thread.start()
+
+
+def flush_at_exit():
+    """Write aggregated events while the process is exiting
+    """
+    try:
+        flush()
+    except Exception as e:
+        logger.error(e)
+
+
+def flush() -> int:
+    """Write aggregated events to the database and refresh affected lists
+
+    Returns number of updated scores documents.
+    """
+    global _pending, _last_flush
+
+    with _pending_lock:
+        pending, _pending = _pending, {}
+        _last_flush = datetime.now()
+
+    if not pending:
+        return 0
+
+    ops = []
+    affected = set()  # type: Set[Tuple[str, str]]
+    for (model, eid, lng, metric), (scores, last) in pending.items():
+        values = {'model': model, 'eid': eid, 'lng': lng, 'last_' + metric: {'$max': ['$last_' + metric, last]}}
+        for window, score in scores.items():
+            values[_score_field(metric, window)] = _log_add_exp_expr(_score_field(metric, window), score)
+        ops.append(UpdateOne({'_id': '{}:{}'.format(model, eid)}, [{'$set': values}], upsert=True))
+        affected.add((model, lng))
+
+    _scores().bulk_write(ops, ordered=False)
+
+    for model in {a[0] for a in affected}:
+        refresh(model, [a[1] for a in affected if a[0] == model])
+
+    return len(ops)
+
+
+def _build_list(model: str, lng: str, metric: str, window: str, now: datetime) -> List[Tuple[str, float]]:
+    """Build a top list from scores
+    """
+    window_len = _windows()[window]
+    f_name = _score_field(metric, window)
+    query = {'model': model, 'lng': lng, f_name: {'$exists': True}}
+
+    # Only entities which had events within the window are ranked
+    if metric == 'trending':
+        cutoff = now - timedelta(seconds=window_len)
+        query['$or'] = [{'last_' + m: {'$gte': cutoff}} for m in METRICS if m != 'trending']
+    else:
+        query['last_' + metric] = {'$gte': now - timedelta(seconds=window_len)}
+
+    cursor = _scores().find(query, {'eid': 1, f_name: 1}, sort=[(f_name, DESCENDING)], limit=_list_length())
+
+    return [(doc['eid'], _decayed(doc[f_name], window_len, now)) for doc in cursor]
+
+
+def _store_list(model: str, lng: str, metric: str, window: str, items: List[Tuple[str, float]], now: datetime):
+    _lists().replace_one({'_id': ':'.join((model, lng, metric, window))}, {
+        'ids': [i[0] for i in items],
+        'scores': [round(i[1], 4) for i in items],
+        'updated': now,
+    }, True)
+
+
+def refresh(model: str = None, languages: List[str] = None):
+    """Rebuild top lists
+
+    Lists of all languages are rebuilt unless `languages` is specified; lists of all languages combined are rebuilt
+    from per language lists, because the combined top is a subset of their union.
+    """
+    now = datetime.now()
+    models = [model] if model else _api.get_models()
+    all_languages = list(lang.langs()) + ['']
+
+    for m in models:
+        for metric in METRICS:
+            for window in _windows():
+                by_lng = {}  # type: Dict[str, List[Tuple[str, float]]]
+                for lng in all_languages:
+                    if languages is None or lng in languages:
+                        by_lng[lng] = _build_list(m, lng, metric, window, now)
+                        _store_list(m, lng, metric, window, by_lng[lng], now)
+                    else:
+                        by_lng[lng] = _get_list(m, lng, metric, window, now)
+
+                combined = sorted((i for items in by_lng.values() for i in items), key=lambda i: i[1], reverse=True)
+                _store_list(m, '*', metric, window, combined[:_list_length()], now)
+
+
+def _get_list(model: str, lng: str, metric: str, window: str, now: datetime = None) -> List[Tuple[str, float]]:
+    """Get a stored top list
+
+    Scores are decayed at the moment the list was built, if `now` is specified they are decayed further to it.
+    """
+    doc = _lists().find_one({'_id': ':'.join((model, lng, metric, window))})
+    if not doc:
+        return []
+
+    factor = math.exp(-(now - doc['updated']).total_seconds() / _windows()[window]) if now else 1.0
+
+    return [(eid, score * factor) for eid, score in zip(doc['ids'], doc['scores'])]
+
+
+def prune() -> int:
+    """Remove scores of entities which had no events within the longest window
+    """
+    cutoff = datetime.now() - timedelta(seconds=max(_windows().values()))
+    query = {'$and': [{'last_' + m: {'$not': {'$gte': cutoff}}} for m in METRICS if m != 'trending']}
+    r = _scores().delete_many(query).deleted_count
+    if r:
+        logger.info('{} outdated ranking scores removed'.format(r))
+
+    return r
+
+
+def remove(model: str, eid: str):
+    """Remove scores of an entity
+    """
+    with _pending_lock:
+        for key in [k for k in _pending if k[0] == model and k[1] == eid]:
+            del _pending[key]
+
+    _scores().delete_one({'_id': '{}:{}'.format(model, eid)})
+
+
+def get_top(model: str, metric: str = 'views', window: str = '7d', language: Optional[str] = None,
+            limit: int = 10) -> List[Content]:
+    """Get top entities of a model
+
+    `metric` is one of 'views', 'comments', 'likes' or 'trending', which combines them using weights. `language` is the
+    current one by default, '*' means all languages; it is ignored for models without languages. Lists are rebuilt by
+    cron, so unpublished and deleted entities are skipped while fetching.
+    """
+    if metric not in METRICS:
+        raise ValueError("Invalid ranking metric: '{}'".format(metric))
+    if window not in _windows():
+        raise ValueError("Invalid ranking window: '{}'".format(window))
+
+    # Scores of models without languages are stored under empty language
+    if not _api.get_model_schema(model).has_field('language'):
+        language = ''
+    elif not language:
+        language = lang.get_current()
+
+    pool = cache.get_pool('content@ranking')
+    cache_key = ':'.join((model, language, metric, window))
+    try:
+        ids = pool.get(cache_key)
+    except cache.error.KeyNotExist:
+        ids = [i[0] for i in _get_list(model, language, metric, window)]
+        pool.put(cache_key, ids, reg.get('content.ranking_cache_ttl', 60))
+
+    if not ids:
+        return []
+
+    entities = {e.id: e for e in _api.find(model, language=language or '*').inc('_id', ids).get()}
+
+    return [entities[eid] for eid in ids if eid in entities][:limit]
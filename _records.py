@@ -0,0 +1,87 @@
+"""PytSite Content Plugin Read-only Records
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from functools import lru_cache
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Tuple
+from plugins import odm
+
+
+class Record(tuple):
+    """Base Read-only Content Record
+
+    Records are tuples holding an entity's ID and stored values of projected fields. They have no hooks, field objects
+    and changes tracking, so they are cheap to construct and keep in memory while processing lots of entities.
+    """
+
+    __slots__ = ()
+
+    model = None  # type: str
+    fields = ()  # type: Tuple[str, ...]
+
+    @property
+    def id(self) -> str:
+        return self[0]
+
+    def get(self, field_name: str, default=None):
+        """Get a field's value
+        """
+        try:
+            return self[self.fields.index(field_name) + 1]
+        except ValueError:
+            return default
+
+    def as_dict(self) -> dict:
+        """Get record as a dict
+        """
+        return dict(zip(('_id',) + self.fields, self))
+
+    def __repr__(self) -> str:
+        values = ', '.join('{}={!r}'.format(k, v) for k, v in self.as_dict().items())
+
+        return '{}({})'.format(type(self).__name__, values)
+
+
+@lru_cache(maxsize=None)
+def record_class(model: str, fields: Tuple[str, ...]) -> type:
+    """Get record class for a model and set of fields
+    """
+    attrs = {'__slots__': (), 'model': model, 'fields': fields}
+    for i, field_name in enumerate(fields, 1):
+        # Fields like `_modified` are accessible via their names without leading underscore
+        attr_name = field_name.lstrip('_')
+        if hasattr(Record, attr_name) or attr_name in attrs:
+            raise ValueError("Field '{}' collides with attribute '{}' of records".format(field_name, attr_name))
+        attrs[attr_name] = property(itemgetter(i))
+
+    return type('{}Record'.format(''.join(p.capitalize() for p in model.split('_'))), (Record,), attrs)
+
+
+def records(finder: odm.SingleModelFinder, fields: Iterable[str], sort: List[Tuple[str, int]] = None, limit: int = 0,
+            batch_size: int = 1000) -> Iterator[Record]:
+    """Iterate over read-only records of entities matched by a finder
+
+    Only projected fields are fetched from the database. Entities are ordered by `sort` or by the finder's sort, and by
+    ID if neither is specified. The finder's skip is respected, its limit is used unless `limit` is specified.
+    """
+    fields = tuple(fields)
+    for field_name in fields:
+        if not finder.mock.has_field(field_name):
+            raise ValueError("Model '{}' has no field '{}'".format(finder.model, field_name))
+
+    cls = record_class(finder.model, fields)
+    projection = dict.fromkeys(fields, 1)
+
+    # Finders provide no getters of their options
+    sort = sort or getattr(finder, '_sort', None) or [('_id', 1)]
+    limit = limit or getattr(finder, '_limit', 0) or 0
+    skip = getattr(finder, '_skip', 0) or 0
+
+    cursor = finder.mock.collection.find(finder.query.compile(), projection, skip=skip, limit=limit, sort=sort,
+                                         batch_size=batch_size)
+
+    for doc in cursor:
+        yield cls((str(doc['_id']),) + tuple(doc.get(f) for f in fields))
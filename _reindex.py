@@ -0,0 +1,211 @@
+"""PytSite Content Plugin Denormalized Fields Recomputation
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import math
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from pytsite import reg, lang, logger
+from plugins import odm, auth
+from . import _api, _autocomplete
+from ._model import _plain_text, _excerpt
+from ._records import Record
+from ._transfer import _ref_id
+
+# Flag variants of counter fields
+_FLAG_COUNTERS = {
+    'likes_count': 'like',
+    'bookmarks_count': 'bookmark',
+}
+
+# Fields which values are recomputed
+_DERIVED_FIELDS = ('body_text', 'excerpt', 'word_count', 'reading_time', 'title_prefix_keys', 'comments_count') + \
+                  tuple(_FLAG_COUNTERS)
+
+
+def _flag_counts(model: str, ids: List[str]) -> Dict[Tuple[str, str], int]:
+    """Count flags of multiple entities by a single grouped aggregation
+
+    Returns counts keyed by entity's ID and flag's variant.
+    """
+    mock = odm.dispense('flag')
+
+    # Stored form of references is produced by the flag model's field, so it matches stored flags
+    stored_refs = [mock.f_set('entity', '{}:{}'.format(model, eid)).get_field('entity').get_storable_val()
+                   for eid in ids]
+    refs = {str(ref): eid for ref, eid in zip(stored_refs, ids)}
+
+    pipeline = [
+        {'$match': {'entity': {'$in': stored_refs}, 'variant': {'$in': list(_FLAG_COUNTERS.values())}}},
+        {'$group': {'_id': {'entity': '$entity', 'variant': '$variant'}, 'count': {'$sum': 1}}},
+    ]
+
+    r = {}
+    for doc in mock.collection.aggregate(pipeline):
+        eid = refs.get(str(doc['_id']['entity']))
+        if eid:
+            r[(eid, doc['_id']['variant'])] = doc['count']
+
+    return r
+
+
+def _aliases(records: List[Record]) -> Dict[str, str]:
+    """Get route aliases' strings of multiple entities by a single query
+    """
+    alias_ids = {_ref_id(rec.get('route_alias')): rec.id for rec in records if rec.get('route_alias')}
+    if not alias_ids:
+        return {}
+
+    collection = odm.dispense('route_alias').collection
+    docs = collection.find({'_id': {'$in': [ObjectId(i) for i in alias_ids]}}, {'alias': 1})
+
+    return {alias_ids[str(doc['_id'])]: doc['alias'] for doc in docs}
+
+
+def _expected_values(records: List[Record], model: str) -> Dict[str, Dict[str, Any]]:
+    """Calculate values of denormalized fields of multiple entities
+    """
+    from plugins import comments
+
+    schema = _api.get_model_schema(model)
+    r = {rec.id: {} for rec in records}
+
+    for rec in records:
+        # Plain text derivatives of the body
+        if schema.has_field('body_text'):
+            text = _plain_text(rec.get('body') or '')
+            word_count = len(text.split())
+            r[rec.id]['body_text'] = text
+            r[rec.id]['excerpt'] = _excerpt(text, reg.get('content.excerpt_length', 300))
+            r[rec.id]['word_count'] = word_count
+            r[rec.id]['reading_time'] = math.ceil(word_count / reg.get('content.reading_speed', 200))
+
+        # Title prefix keys used by autocomplete
+        if schema.has_field('title_prefix_keys'):
+            r[rec.id]['title_prefix_keys'] = _autocomplete.title_prefix_keys(rec.get('title'))
+
+    # Comments are counted by drivers, which provide no bulk API, so only route aliases are fetched in bulk
+    if schema.has_field('comments_count') and schema.has_field('route_alias'):
+        for eid, alias in _aliases(records).items():
+            try:
+                r[eid]['comments_count'] = comments.get_all_comments_count(alias)
+            except (NotImplementedError, comments.error.NoDriversRegistered):
+                break
+
+    # Flags are counted by a single aggregation per batch
+    flag_fields = [f_name for f_name in _FLAG_COUNTERS if schema.has_field(f_name)]
+    if flag_fields:
+        counts = _flag_counts(model, [rec.id for rec in records])
+        for rec in records:
+            for f_name in flag_fields:
+                r[rec.id][f_name] = counts.get((rec.id, _FLAG_COUNTERS[f_name]), 0)
+
+    return r
+
+
+def _localization_fixes(records: List[Record], model: str) -> List[Tuple[str, str, str]]:
+    """Get localizations which don't refer back to entities
+
+    Referenced localizations are fetched by a single query. Returns tuples of localization's ID, field name and ID of
+    the entity it should refer to.
+    """
+    languages = [lng for lng in lang.langs() if _api.get_model_schema(model).has_field('localization_' + lng)]
+    refs = []  # type: List[Tuple[str, str, str]]
+    for rec in records:
+        if not rec.get('language'):
+            continue
+
+        for lng in languages:
+            localization_id = _ref_id(rec.get('localization_' + lng)) if lng != rec.get('language') else None
+            if localization_id:
+                refs.append((localization_id, 'localization_' + rec.get('language'), rec.id))
+
+    if not refs:
+        return []
+
+    projection = dict.fromkeys(('localization_' + lng for lng in languages), 1)
+    collection = _api.dispense(model).collection
+    localizations = {str(doc['_id']): doc for doc in collection.find(
+        {'_id': {'$in': [ObjectId(r[0]) for r in refs]}}, projection)}
+
+    return [r for r in refs if r[0] in localizations and _ref_id(localizations[r[0]].get(r[1])) != r[2]]
+
+
+def _apply(model: str, updates: Dict[str, Dict[str, Any]]):
+    """Apply updates with a single unordered bulk write
+    """
+    if updates:
+        ops = [UpdateOne({'_id': ObjectId(eid)}, {'$set': values}) for eid, values in updates.items()]
+        _api.dispense(model).collection.bulk_write(ops, ordered=False)
+        odm.clear_cache(model)
+
+
+def recompute(model: str, dry_run: bool = False, batch_size: int = None) -> Dict[str, int]:
+    """Recompute denormalized fields of all entities of a model
+
+    Entities are iterated as records, counters are computed per batch. Changes are applied by bulk writes without
+    firing entities hooks. Returns numbers of changed values per field.
+    """
+    batch_size = batch_size or reg.get('content.reindex_batch_size', 500)
+    schema = _api.get_model_schema(model)
+    fields = [f for f in ('title', 'body', 'language', 'route_alias') + _DERIVED_FIELDS if schema.has_field(f)]
+    fields += [f for f in schema.fields if f.startswith('localization_')]
+    diff = {}  # type: Dict[str, int]
+
+    try:
+        auth.switch_user_to_system()
+
+        finder = _api.find(model, language='*', status='*', check_publish_time=False)
+        records = _api.records(finder, fields, batch_size=batch_size)
+        mock = _api.dispense(model)
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+
+            updates = {}  # type: Dict[str, Dict[str, Any]]
+            current = {rec.id: rec for rec in batch}
+            for eid, values in _expected_values(batch, model).items():
+                for f_name, value in values.items():
+                    if current[eid].get(f_name) != value:
+                        updates.setdefault(eid, {})[f_name] = value
+                        diff[f_name] = diff.get(f_name, 0) + 1
+
+            # Storable values of references are produced by fields of a mock
+            for localization_id, f_name, eid in _localization_fixes(batch, model):
+                value = mock.f_set(f_name, '{}:{}'.format(model, eid)).get_field(f_name).get_storable_val()
+                updates.setdefault(localization_id, {})[f_name] = value
+                diff[f_name] = diff.get(f_name, 0) + 1
+
+            # Missing route aliases are created in bulk, only their entities are fetched
+            missing_aliases = [rec.id for rec in batch if 'route_alias' in fields and not rec.get('route_alias')]
+            if missing_aliases:
+                diff['route_alias'] = diff.get('route_alias', 0) + len(missing_aliases)
+
+            if not dry_run:
+                _apply(model, updates)
+                if missing_aliases:
+                    f = _api.find(model, language='*', status='*', check_publish_time=False)
+                    _api.create_route_aliases(list(f.inc('_id', missing_aliases).get()))
+
+    finally:
+        auth.restore_user()
+
+    logger.info("Denormalized fields of model '{}' {}: {}".format(model, 'checked' if dry_run else 'recomputed', diff))
+
+    return diff
+
+
+def recompute_models(models: Iterable[str], dry_run: bool = False, workers: int = None) -> Dict[str, Dict[str, int]]:
+    """Recompute denormalized fields of multiple models in parallel
+    """
+    models = list(models)
+    workers = workers or reg.get('content.reindex_workers', 4)
+
+    with ThreadPoolExecutor(min(workers, len(models)) or 1) as executor:
+        return dict(zip(models, executor.map(lambda m: recompute(m, dry_run), models)))
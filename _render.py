@@ -0,0 +1,134 @@
+"""PytSite Content Plugin Body Rendering Cache
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import re
+import htmler
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional
+from pytsite import reg, router, util
+from plugins import file, widget
+
+_youtube_id_re = re.compile('(?:youtu\\.be/|youtube\\.com/(?:watch\\?(?:.*&)?v=|embed/|v/))([a-zA-Z0-9_-]{11})')
+_facebook_id_re = re.compile('facebook\\.com/.*?/?videos/(?:[^/]+/)?(\\d+)')
+_vimeo_id_re = re.compile('vimeo\\.com/(?:video/)?(\\d+)')
+
+
+class LRUCache:
+    """Thread safe LRU cache
+    """
+
+    def __init__(self, size_reg_key: str, default_size: int):
+        self._size_reg_key = size_reg_key
+        self._default_size = default_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, factory: Callable[[], str]) -> str:
+        """Get cached value, calculating it if necessary
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        value = factory()
+
+        with self._lock:
+            self._items[key] = value
+            max_size = reg.get(self._size_reg_key, self._default_size)
+            while len(self._items) > max_size:
+                self._items.popitem(False)
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_images_cache = LRUCache('content.images_render_cache_size', 10000)
+_videos_cache = LRUCache('content.videos_render_cache_size', 1000)
+
+
+def render_image(img: file.model.AbstractImage, alt: str = '', css: str = '', enlarge: bool = True, width: int = 0,
+                 height: int = 0, responsive: bool = True, link_orig: bool = False, link_target: str = '_blank',
+                 link_class: str = '') -> str:
+    """Get HTML code of an image
+
+    Results are cached and shared across entities and requests.
+    """
+
+    def factory():
+        if responsive:
+            r = img.get_responsive_html(alt, enlarge=enlarge, css=util.escape_html(css))
+        else:
+            r = img.get_html(alt, width=width, height=height, enlarge=enlarge, css=util.escape_html(css))
+
+        # Link to original file
+        if link_orig:
+            link = htmler.A(r, href=img.url, target=link_target, title=util.escape_html(alt))
+            if link_class:
+                link.set_attr('css', util.escape_html(link_class))
+            r = str(link)
+
+        return r
+
+    key = (router.base_url(), img.uid, alt, css, enlarge, width, height, responsive, link_orig, link_target,
+           link_class)
+
+    return _images_cache.get(key, factory)
+
+
+def render_images(entity, responsive: bool = True, width: int = 0, height: int = 0) -> List[str]:
+    """Get HTML code of all images of an entity in one pass
+
+    :type entity: plugins.content.model.Content
+    """
+    if not entity.has_field('images'):
+        return []
+
+    alt = entity.title if entity.has_field('title') else ''
+    enlarge = reg.get('content.enlarge_images', True)
+    responsive = responsive and not (width or height)
+
+    return [render_image(img, alt, enlarge=enlarge, width=width, height=height, responsive=responsive)
+            for img in entity.images]
+
+
+def render_video(link: str, uid: str) -> str:
+    """Get HTML code of a video player
+
+    Results are cached and shared across entities and requests.
+    """
+    return _videos_cache.get((link, uid), lambda: str(widget.misc.VideoPlayer(uid, value=link)))
+
+
+def resolve_video_meta(link: str) -> dict:
+    """Get provider, video ID and thumbnail URL of a video link
+    """
+    provider = vid = thumbnail = None  # type: Optional[str]
+
+    match = _youtube_id_re.search(link)
+    if match:
+        provider, vid = 'youtube', match.group(1)
+        thumbnail = 'https://img.youtube.com/vi/{}/hqdefault.jpg'.format(vid)
+    else:
+        match = _facebook_id_re.search(link)
+        if match:
+            provider, vid = 'facebook', match.group(1)
+            thumbnail = 'https://graph.facebook.com/{}/picture'.format(vid)
+        else:
+            match = _vimeo_id_re.search(link)
+            if match:
+                provider, vid = 'vimeo', match.group(1)
+
+    return {
+        'url': link,
+        'provider': provider,
+        'id': vid,
+        'thumbnail': thumbnail,
+    }
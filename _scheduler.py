@@ -0,0 +1,138 @@
+"""PytSite Content Plugin Scheduled Publishing
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import heapq
+import threading
+from datetime import datetime
+from typing import List, Tuple, Optional
+from pytsite import mongodb, events, logger, reg
+from plugins import auth, odm
+from ._constants import CONTENT_STATUS_PUBLISHED
+
+_COLLECTION_NAME = 'content_publish_queue'
+
+_queue = []  # type: List[Tuple[datetime, str, str]]
+_queue_lock = threading.Lock()
+_timer = None  # type: Optional[threading.Timer]
+_is_rebuilt = False
+
+
+def _collection():
+    return mongodb.get_collection(_COLLECTION_NAME)
+
+
+def _arm_timer():
+    """(Re)start timer to fire at the earliest publish time
+    """
+    global _timer
+
+    if _timer:
+        _timer.cancel()
+        _timer = None
+
+    if _queue:
+        delay = max((_queue[0][0] - datetime.now()).total_seconds(), 0)
+        _timer = threading.Timer(delay, _fire_due)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _push(publish_time: datetime, model: str, eid: str):
+    with _queue_lock:
+        heapq.heappush(_queue, (publish_time, model, eid))
+        if _queue[0] == (publish_time, model, eid):
+            _arm_timer()
+
+
+def _fire_due():
+    """Fire publish events for entities which publish time has come
+    """
+    from . import _api
+
+    now = datetime.now()
+    due = []
+    with _queue_lock:
+        while _queue and _queue[0][0] <= now:
+            due.append(heapq.heappop(_queue))
+        _arm_timer()
+
+    for publish_time, model, eid in due:
+        # Only one process fires the event
+        if not _collection().find_one_and_delete({'_id': '{}:{}'.format(model, eid), 'publish_time': {'$lte': now}}):
+            continue
+
+        try:
+            auth.switch_user_to_system()
+            entity = _api.dispense(model, eid)
+            if entity.status == CONTENT_STATUS_PUBLISHED and entity.publish_time <= datetime.now():
+                events.fire('content@entity.published', entity=entity)
+        except odm.error.EntityNotFound:
+            pass
+        except Exception as e:
+            logger.error(e)
+        finally:
+            auth.restore_user()
+
+
+def schedule(entity):
+    """Schedule or unschedule firing of an entity's publish event according to its status and publish time
+
+    :type entity: plugins.content.model.Content
+    """
+    if not (entity.has_field('publish_time') and entity.has_field('status')):
+        return
+
+    key = '{}:{}'.format(entity.model, entity.id)
+    if entity.status == CONTENT_STATUS_PUBLISHED and entity.publish_time > datetime.now():
+        _collection().replace_one({'_id': key}, {
+            '_id': key,
+            'model': entity.model,
+            'eid': entity.id,
+            'publish_time': entity.publish_time,
+        }, True)
+        _push(entity.publish_time, entity.model, entity.id)
+    else:
+        # Stale items remaining in memory queues are skipped while firing
+        _collection().delete_one({'_id': key})
+
+
+def unschedule(model: str, eid: str):
+    """Cancel firing of an entity's publish event
+    """
+    _collection().delete_one({'_id': '{}:{}'.format(model, eid)})
+
+
+def rebuild():
+    """Rebuild persistent queue from content entities which publish time is in the future
+    """
+    from . import _api
+
+    now = datetime.now()
+    for model in _api.get_models():
+        if not _api.get_model_schema(model).has_field('publish_time'):
+            continue
+
+        for entity in _api.find(model, language='*', check_publish_time=False).gt('publish_time', now).get():
+            schedule(entity)
+
+
+def refresh():
+    """Load upcoming items of persistent queue into memory
+    """
+    global _is_rebuilt
+
+    if not _is_rebuilt:
+        _collection().create_index([('publish_time', 1)])
+        rebuild()
+        _is_rebuilt = True
+
+    items = _collection().find().sort('publish_time', 1).limit(reg.get('content.publish_queue_size', 1000))
+    with _queue_lock:
+        _queue.clear()
+        for item in items:
+            _queue.append((item['publish_time'], item['model'], item['eid']))
+        heapq.heapify(_queue)
+        _arm_timer()
@@ -0,0 +1,100 @@
+"""PytSite Content Plugin Models Schemas
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import threading
+from types import MappingProxyType
+from typing import Dict, Mapping, Tuple, Type
+from plugins import odm
+
+_schemas = {}  # type: Dict[str, Schema]
+_schemas_lock = threading.Lock()
+
+
+class Schema:
+    """Immutable Content Model Schema Descriptor
+
+    Describes fields, statuses and permissions of a model, so they can be consulted without dispensing entities.
+    """
+
+    __slots__ = ('_model', '_fields', '_statuses', '_permissions')
+
+    def __init__(self, model: str, fields: Mapping[str, Type[odm.field.Abstract]], statuses: Tuple[str, ...],
+                 permissions: Tuple[str, ...]):
+        self._model = model
+        self._fields = MappingProxyType(dict(fields))
+        self._statuses = statuses
+        self._permissions = permissions
+
+    @classmethod
+    def from_entity(cls, entity):
+        """Build a schema from an entity
+
+        :type entity: plugins.content.model.Content
+        """
+        fields = {name: type(field) for name, field in entity.fields.items()}
+        statuses = tuple(entity.content_statuses()) if 'status' in fields else ()
+
+        return cls(entity.model, fields, statuses, tuple(entity.odm_auth_permissions()))
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def fields(self) -> Mapping[str, Type[odm.field.Abstract]]:
+        """Names and types of fields
+        """
+        return self._fields
+
+    @property
+    def statuses(self) -> Tuple[str, ...]:
+        return self._statuses
+
+    @property
+    def permissions(self) -> Tuple[str, ...]:
+        """Names of model's permissions, without model's name
+        """
+        return self._permissions
+
+    def has_field(self, field_name: str) -> bool:
+        """Check if the model has a field
+        """
+        return field_name in self._fields
+
+    def __setattr__(self, key, value):
+        if hasattr(self, '_permissions'):
+            raise AttributeError('Schema is immutable')
+
+        super().__setattr__(key, value)
+
+    def __repr__(self) -> str:
+        return 'Schema({!r}, fields={})'.format(self._model, sorted(self._fields))
+
+
+def build(model: str) -> Schema:
+    """Build and store schema of a model
+    """
+    schema = Schema.from_entity(odm.dispense(model))
+    with _schemas_lock:
+        _schemas[model] = schema
+
+    return schema
+
+
+def get(model: str) -> Schema:
+    """Get schema of a model
+    """
+    try:
+        return _schemas[model]
+    except KeyError:
+        return build(model)
+
+
+def remove(model: str):
+    """Remove schema of a model
+    """
+    with _schemas_lock:
+        _schemas.pop(model, None)
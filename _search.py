@@ -0,0 +1,269 @@
+"""PytSite Content Plugin Search
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import re
+import math
+import unicodedata
+from typing import List, Dict, Tuple, Callable, Optional
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pytsite import reg, mongodb
+from plugins import odm
+
+_WORD_RE = re.compile('\\w+', re.UNICODE)
+_HTML_TAG_RE = re.compile('<[^>]*>')
+_BODY_TAG_RE = re.compile('\\[(?:img|vid):\\d+[^\\]]*\\]')
+
+_EN_SUFFIXES = ('ational', 'fulness', 'iveness', 'ization', 'ousness', 'ations', 'ements', 'ingly', 'ities',
+                'ation', 'ement', 'ments', 'ness', 'ment', 'edly', 'able', 'ible', 'ings', 'ies', 'ing', 'ers',
+                'est', 'ful', 'ed', 'er', 'es', 'ly', 's')
+
+_RU_SUFFIXES = ('ившись', 'ывшись', 'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ость', 'ости',
+                'ение', 'ения', 'ений', 'ться', 'тся', 'ешь', 'ишь', 'ете', 'ите', 'ать', 'ять', 'ить', 'еть',
+                'ают', 'яют', 'ует', 'ает', 'яет', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ам', 'ям',
+                'ах', 'ях', 'ом', 'ем', 'ов', 'ев', 'ей', 'ию', 'ия', 'ть', 'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю')
+
+# Weights of text fields
+_FIELD_WEIGHTS = (('title', 5), ('description', 2), ('body', 1))
+
+_engines = {}  # type: Dict[str, Engine]
+
+
+def normalize(s: str) -> str:
+    """Case fold a string and strip diacritics from it
+    """
+    s = unicodedata.normalize('NFKD', s.casefold())
+
+    return ''.join(c for c in s if not unicodedata.combining(c))
+
+
+def _strip_suffix(word: str, suffixes: Tuple[str, ...], min_stem_len: int) -> str:
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_stem_len:
+            return word[:-len(suffix)]
+
+    return word
+
+
+_stemmers = {
+    'english': lambda w: _strip_suffix(w, _EN_SUFFIXES, 3),
+    'russian': lambda w: _strip_suffix(w, _RU_SUFFIXES, 3),
+}  # type: Dict[str, Callable[[str], str]]
+
+
+def stem(word: str, language_db: str) -> str:
+    """Get stem of a normalized word
+    """
+    stemmer = _stemmers.get(language_db)
+
+    return stemmer(word) if stemmer else word
+
+
+def words(s: str) -> List[str]:
+    """Split a string into normalized words
+    """
+    return _WORD_RE.findall(normalize(s))
+
+
+def tokenize(s: str, language_db: str = 'none') -> List[str]:
+    """Split a string into normalized and stemmed terms
+    """
+    return [stem(w, language_db) for w in words(s)]
+
+
+def _language_db(language: str) -> str:
+    return {'en': 'english', 'ru': 'russian'}.get(language, 'none')
+
+
+def _entity_text(entity, field_name: str) -> str:
+    """Get plain text of an entity's field
+    """
+    if field_name == 'body' and entity.has_field('body_text'):
+        return entity.body_text
+
+    value = entity.f_get(field_name, process_tags=False) if field_name == 'body' else entity.f_get(field_name)
+
+    return _HTML_TAG_RE.sub(' ', _BODY_TAG_RE.sub(' ', value or ''))
+
+
+class Engine(ABC):
+    """Base Search Engine
+    """
+
+    def index(self, entity):
+        """Add an entity to the index or update it
+
+        :type entity: plugins.content.model.Content
+        """
+        pass
+
+    def remove(self, model: str, eid: str):
+        """Remove an entity from the index
+        """
+        pass
+
+    @abstractmethod
+    def apply(self, finder: odm.SingleModelFinder, query: str, language: str):
+        """Filter a finder by a search query
+        """
+        pass
+
+    @abstractmethod
+    def apply_prefix(self, finder: odm.MultiModelFinder, model: str, prefix: str, language: str):
+        """Filter a finder by a search prefix, used for autocompletion
+        """
+        pass
+
+    def search(self, model: str, query: str, language: str, limit: int = 100) -> Optional[List[str]]:
+        """Get ranked IDs of entities matching a search query
+
+        None means that the engine doesn't rank results itself.
+        """
+        return None
+
+
+class MongoTextEngine(Engine):
+    """MongoDB Text Index Search Engine
+    """
+
+    def apply(self, finder: odm.SingleModelFinder, query: str, language: str):
+        finder.text(query, language)
+
+    def apply_prefix(self, finder: odm.MultiModelFinder, model: str, prefix: str, language: str):
+        from . import _autocomplete
+
+        _autocomplete.apply_regex(finder, prefix)
+
+
+class InvertedIndexEngine(Engine):
+    """Embedded Inverted Index Search Engine
+
+    Postings are stored in a MongoDB collection, one document per (language, model, term, entity).
+    """
+
+    def __init__(self, collection_name: str = 'content_search_index'):
+        self._collection_name = collection_name
+        self._indexes_created = False
+
+    @property
+    def _postings(self):
+        collection = mongodb.get_collection(self._collection_name)
+
+        if not self._indexes_created:
+            collection.create_index([('lng', 1), ('model', 1), ('term', 1)])
+            collection.create_index([('model', 1), ('eid', 1)])
+            self._indexes_created = True
+
+        return collection
+
+    @property
+    def _stats(self):
+        return mongodb.get_collection(self._collection_name + '_stats')
+
+    def index(self, entity):
+        language = entity.language
+        language_db = entity.f_get('language_db') or _language_db(language)
+
+        weights = {}  # type: Dict[str, int]
+        for field_name, field_weight in _FIELD_WEIGHTS:
+            if entity.has_field(field_name):
+                for term in tokenize(_entity_text(entity, field_name), language_db):
+                    weights[term] = weights.get(term, 0) + field_weight
+
+        publish_time = entity.publish_time if entity.has_field('publish_time') else entity.f_get('_modified')
+        postings = [{
+            'lng': language,
+            'model': entity.model,
+            'eid': entity.id,
+            'term': term,
+            'w': weight,
+            'pt': publish_time,
+        } for term, weight in weights.items()]
+
+        is_reindex = self._postings.delete_many({'model': entity.model, 'eid': entity.id}).deleted_count > 0
+        if postings:
+            self._postings.insert_many(postings, ordered=False)
+
+        if not is_reindex:
+            self._stats.update_one({'_id': '{}:{}'.format(entity.model, language)}, {'$inc': {'docs': 1}}, True)
+
+    def remove(self, model: str, eid: str):
+        posting = self._postings.find_one({'model': model, 'eid': eid}, {'lng': 1})
+        if posting:
+            self._postings.delete_many({'model': model, 'eid': eid})
+            self._stats.update_one({'_id': '{}:{}'.format(model, posting['lng'])}, {'$inc': {'docs': -1}})
+
+    def _rank(self, model: str, terms: List[str], language: str, prefix: str = None, limit: int = 100) -> List[str]:
+        """Rank entities by terms using TF-IDF with publish time decay
+        """
+        cond = [{'term': {'$in': terms}}] if terms else []
+        if prefix:
+            cond.append({'term': {'$regex': '^' + re.escape(prefix)}})
+        if not cond:
+            return []
+
+        q = {'lng': language, 'model': model, '$or': cond}
+        postings = list(self._postings.find(q, {'_id': 0, 'eid': 1, 'term': 1, 'w': 1, 'pt': 1}))
+
+        stats = self._stats.find_one({'_id': '{}:{}'.format(model, language)}) or {}
+        total_docs = max(stats.get('docs', 0), 1)
+
+        doc_freq = {}  # type: Dict[str, int]
+        for p in postings:
+            doc_freq[p['term']] = doc_freq.get(p['term'], 0) + 1
+
+        now = datetime.now()
+        half_life = reg.get('content.search_decay_half_life', 30)
+        scores = {}  # type: Dict[str, float]
+        for p in postings:
+            score = p['w'] * math.log(1 + total_docs / doc_freq[p['term']])
+            if half_life and p.get('pt'):
+                age_days = max((now - p['pt']).total_seconds(), 0) / 86400
+                score *= 0.5 ** (age_days / half_life)
+            scores[p['eid']] = scores.get(p['eid'], 0) + score
+
+        return [eid for eid, _ in sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]]
+
+    def search(self, model: str, query: str, language: str, limit: int = 100) -> List[str]:
+        return self._rank(model, tokenize(query, _language_db(language)), language, limit=limit)
+
+    def suggest(self, model: str, prefix: str, language: str, limit: int = 100) -> List[str]:
+        """Get ranked IDs of entities which have a term starting with the last word of the prefix
+        """
+        terms = tokenize(prefix, _language_db(language))
+        if not terms:
+            return []
+
+        return self._rank(model, terms[:-1], language, terms[-1], limit)
+
+    def apply(self, finder: odm.SingleModelFinder, query: str, language: str):
+        finder.inc('_id', self.search(finder.model, query, language, reg.get('content.search_max_results', 1000)))
+
+    def apply_prefix(self, finder: odm.MultiModelFinder, model: str, prefix: str, language: str):
+        finder.inc('_id', self.suggest(model, prefix, language, reg.get('content.search_max_results', 1000)))
+
+
+def register_engine(name: str, engine: Engine, replace: bool = False):
+    """Register a search engine
+    """
+    if name in _engines and not replace:
+        raise KeyError("Search engine '{}' is already registered".format(name))
+
+    _engines[name] = engine
+
+
+def get_engine(name: str = None) -> Engine:
+    """Get a search engine, configured one by default
+    """
+    name = name or reg.get('content.search_engine', 'mongodb')
+    if name not in _engines:
+        raise KeyError("Search engine '{}' is not registered".format(name))
+
+    return _engines[name]
+
+
+register_engine('mongodb', MongoTextEngine())
+register_engine('inverted_index', InvertedIndexEngine())
@@ -27,7 +27,7 @@ class Form(settings.Form):
 
         model_items = []
         for k in sorted(_api.get_models().keys()):
-            if _api.dispense(k).has_field('route_alias'):
+            if _api.get_model_schema(k).has_field('route_alias'):
                 model_items.append((k, _api.get_model_title(k)))
 
         if model_items:
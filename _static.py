@@ -0,0 +1,122 @@
+"""PytSite Content Plugin Pre-compressed Static Files
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import gzip
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from os import path, replace, stat
+from uuid import uuid4
+from typing import Dict, Iterable, Optional
+from pytsite import reg
+from . import _jobs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+
+_SUFFIXES = {
+    'gzip': '.gz',
+    'br': '.br',
+}
+
+
+def _write_atomic(file_path: str, data: bytes):
+    tmp_path = '{}.{}.tmp'.format(file_path, uuid4().hex)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    replace(tmp_path, file_path)
+
+
+def _compress(file_path: str, data: bytes, encoding: str) -> int:
+    """Write a compressed sibling of a file and return its size
+    """
+    if encoding == 'gzip':
+        # Fixed mtime makes output depend on content only
+        compressed = gzip.compress(data, reg.get('content.static_gzip_level', 9), mtime=0)
+    elif encoding == 'br':
+        compressed = brotli.compress(data, quality=reg.get('content.static_brotli_quality', 11))
+    else:
+        raise ValueError("Unsupported encoding: '{}'".format(encoding))
+
+    _write_atomic(file_path + _SUFFIXES[encoding], compressed)
+
+    return len(compressed)
+
+
+def get_encodings() -> tuple:
+    """Get encodings available for pre-compression
+
+    Brotli is used only if `brotli` package is installed.
+    """
+    return tuple(e for e in reg.get('content.static_encodings', ('gzip', 'br')) if e != 'br' or brotli)
+
+
+def load_manifest(dir_path: str) -> Dict[str, dict]:
+    """Load metadata of files of a directory
+    """
+    manifest_path = path.join(dir_path, MANIFEST_NAME)
+    if not path.exists(manifest_path):
+        return {}
+
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def precompress(dir_path: str, file_names: Iterable[str], previous_dir_path: str = None) -> Dict[str, dict]:
+    """Write pre-compressed siblings of files and store their metadata to the directory's manifest
+
+    Metadata of each file contains its size, `ETag` and `Last-Modified` values and sizes of its compressed siblings,
+    so a static serving layer can answer conditional requests without touching files. Files which content has not
+    changed since previous run keep their `Last-Modified` value. Already compressed files are only described.
+    """
+    file_names = list(file_names)
+    encodings = get_encodings()
+
+    with _jobs.FileLock('static-' + hashlib.md5(dir_path.encode()).hexdigest(), True):
+        manifest = load_manifest(dir_path)
+        previous = load_manifest(previous_dir_path) if previous_dir_path else manifest
+
+        with ThreadPoolExecutor(reg.get('content.static_compress_workers', 2)) as executor:
+            # Files are processed one by one to keep only one of them in memory, encodings are processed in parallel
+            for file_name in file_names:
+                file_path = path.join(dir_path, file_name)
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+
+                etag = '"{}"'.format(hashlib.sha256(data).hexdigest()[:32])
+                prev = previous.get(file_name)  # type: Optional[dict]
+                is_compressed = file_name.endswith(tuple(_SUFFIXES.values()))
+                file_encodings = () if is_compressed else encodings
+
+                is_unchanged = prev and prev['etag'] == etag
+
+                # Content and compressed siblings have not been changed since previous run
+                if is_unchanged and set(prev['encodings']) == set(file_encodings) and \
+                        all(path.exists(file_path + _SUFFIXES[e]) for e in file_encodings):
+                    manifest[file_name] = prev
+                    continue
+
+                futures = {e: executor.submit(_compress, file_path, data, e) for e in file_encodings}
+                manifest[file_name] = {
+                    'size': len(data),
+                    'etag': etag,
+                    'last_modified': prev['last_modified'] if is_unchanged else
+                    formatdate(stat(file_path).st_mtime, usegmt=True),
+                    'encodings': {e: {'suffix': _SUFFIXES[e], 'size': f.result()} for e, f in futures.items()},
+                }
+
+        manifest_data = json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8')
+        _write_atomic(path.join(dir_path, MANIFEST_NAME), manifest_data)
+
+    return {file_name: manifest[file_name] for file_name in file_names}
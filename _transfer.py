@@ -0,0 +1,381 @@
+"""PytSite Content Plugin Bulk Export and Import
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import gzip
+import json
+from os import path, unlink, replace
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from bson import json_util, ObjectId, DBRef
+from pymongo import ReplaceOne
+from pytsite import reg, logger, mongodb
+from plugins import odm, auth
+from . import _api, _jobs
+
+_JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+_IMPORT_MAP_COLLECTION_NAME = 'content_import_map'
+
+# Models of referenced entities which are never embedded into exported records
+_SKIP_REF_MODELS = ('user', 'role')
+
+ProgressCallback = Callable[[int], None]
+
+
+def _checkpoint_path(name: str) -> str:
+    return path.join(_jobs.jobs_dir(), name + '.checkpoint.json')
+
+
+def _load_checkpoint(name: str) -> dict:
+    checkpoint_path = _checkpoint_path(name)
+    if not path.exists(checkpoint_path):
+        return {}
+
+    with open(checkpoint_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_checkpoint(name: str, checkpoint: dict):
+    tmp_path = _checkpoint_path(name) + '.tmp'
+    with open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    replace(tmp_path, _checkpoint_path(name))
+
+
+def _remove_checkpoint(name: str):
+    if path.exists(_checkpoint_path(name)):
+        unlink(_checkpoint_path(name))
+
+
+def _batches(iterable: Iterable, size: int) -> Iterator[list]:
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _referenced_docs(model: str, docs: List[dict]) -> Dict[str, List[dict]]:
+    """Get raw documents of entities referenced by documents, i. e. images, tags and route aliases
+    """
+    content_models = _api.get_models()
+    refs = {}  # type: Dict[str, Dict[str, List[Tuple[str, str]]]]
+    for entity in odm.find(model).inc('_id', [d['_id'] for d in docs]).get():
+        entity_refs = refs[entity.id] = []
+        for f_name, field in entity.fields.items():
+            if not isinstance(field, (odm.field.Ref, odm.field.RefsList)):
+                continue
+
+            value = entity.f_get(f_name)
+            for ref in (value if isinstance(value, (list, tuple)) else (value,)):
+                if isinstance(ref, odm.model.Entity) and ref.model not in content_models \
+                        and ref.model not in _SKIP_REF_MODELS:
+                    entity_refs.append((ref.model, ref.id))
+
+    # Referenced documents are fetched by a single query per model
+    by_model = {}  # type: Dict[str, set]
+    for entity_refs in refs.values():
+        for ref_model, ref_id in entity_refs:
+            by_model.setdefault(ref_model, set()).add(ref_id)
+
+    ref_docs = {}  # type: Dict[Tuple[str, str], dict]
+    for ref_model, ref_ids in by_model.items():
+        collection = odm.dispense(ref_model).collection
+        for doc in collection.find({'_id': {'$in': [ObjectId(i) for i in ref_ids]}}):
+            ref_docs[(ref_model, str(doc['_id']))] = doc
+
+    return {eid: [{'model': r[0], 'doc': ref_docs[r]} for r in entity_refs if r in ref_docs]
+            for eid, entity_refs in refs.items()}
+
+
+def _export_batch(model: str, docs: List[dict], compress: bool) -> bytes:
+    """Serialize a batch of documents
+    """
+    refs = _referenced_docs(model, docs)
+    lines = []
+    for doc in docs:
+        record = {'model': model, 'doc': doc, 'refs': refs.get(str(doc['_id']), [])}
+        lines.append(json_util.dumps(record, json_options=_JSON_OPTIONS))
+
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+
+    # Each batch is a separate gzip member, so an interrupted export can be resumed by appending new members
+    return gzip.compress(data) if compress else data
+
+
+def export(model: str, file_path: str, language: str = '*', resume: bool = False, workers: int = None,
+           batch_size: int = None, progress: ProgressCallback = None) -> int:
+    """Export entities of a model to a newline-delimited JSON file
+
+    File is gzipped if its name ends with '.gz'. Each record contains an entity's document and documents of entities
+    it refers to, except users and other content entities. Returns number of exported entities.
+    """
+    workers = workers or reg.get('content.transfer_workers', 4)
+    batch_size = batch_size or reg.get('content.transfer_batch_size', 500)
+    compress = file_path.endswith('.gz')
+    checkpoint_name = 'export-' + model
+    lock = _jobs.FileLock(checkpoint_name)
+    if not lock.acquire():
+        raise RuntimeError("Export of model '{}' is already running".format(model))
+
+    try:
+        checkpoint = _load_checkpoint(checkpoint_name) if resume else {}
+        if checkpoint.get('file_path') != file_path:
+            checkpoint = {'file_path': file_path, 'offset': 0, 'last_id': None, 'count': 0}
+
+        query = {}
+        if language != '*' and _api.get_model_schema(model).has_field('language'):
+            query['language'] = language
+        if checkpoint['last_id']:
+            query['_id'] = {'$gt': ObjectId(checkpoint['last_id'])}
+
+        collection = _api.dispense(model).collection
+        cursor = collection.find(query, sort=[('_id', 1)], batch_size=batch_size)
+
+        with open(file_path, 'r+b' if checkpoint['offset'] else 'wb') as f:
+            # Drop data written after the last checkpoint
+            f.seek(checkpoint['offset'])
+            f.truncate()
+
+            with ThreadPoolExecutor(workers) as executor:
+                batches = _batches(cursor, batch_size)
+                while True:
+                    # Batches are serialized in parallel and written in order
+                    chunk = list(islice(batches, workers))
+                    if not chunk:
+                        break
+
+                    for docs, data in zip(chunk, executor.map(lambda b: _export_batch(model, b, compress), chunk)):
+                        f.write(data)
+                        f.flush()
+                        checkpoint.update({
+                            'offset': f.tell(),
+                            'last_id': str(docs[-1]['_id']),
+                            'count': checkpoint['count'] + len(docs),
+                        })
+                        _save_checkpoint(checkpoint_name, checkpoint)
+                        if progress:
+                            progress(checkpoint['count'])
+
+        _remove_checkpoint(checkpoint_name)
+        logger.info("{} entities of model '{}' exported to '{}'".format(checkpoint['count'], model, file_path))
+
+        return checkpoint['count']
+
+    finally:
+        lock.release()
+
+
+# Fields which are computed by entities' hooks or refer to other documents by IDs which change while importing
+_SKIP_IMPORT_FIELDS = ('route_alias', 'body_text', 'excerpt', 'word_count', 'reading_time', 'title_prefix_keys',
+                       'video_meta', 'prev_status', 'tmp_route_alias_str')
+
+
+def _import_map():
+    """Get collection of imported entities
+
+    Documents are keyed by import's name and old ID of an entity, they hold entity's model and new ID, and localization
+    references to be linked after all entities are imported as (field name, old ID of referenced entity).
+    """
+    collection = mongodb.get_collection(_IMPORT_MAP_COLLECTION_NAME)
+    collection.create_index([('job', 1), ('old_id', 1)])
+
+    return collection
+
+
+def _ref_id(value) -> Optional[str]:
+    """Extract ID of a referenced document from a stored reference
+    """
+    if isinstance(value, DBRef):
+        return str(value.id)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, str) and value:
+        return value.rsplit(':', 1)[-1]
+
+    return None
+
+
+def _import_batch_raw(job: str, lines: List[str]) -> Dict[str, int]:
+    """Write a batch of records to the database directly, bypassing hooks
+
+    Documents are upserted by their IDs, so batches can be written again safely.
+    """
+    ops = {}  # type: Dict[str, List[ReplaceOne]]
+    for line in lines:
+        record = json_util.loads(line, json_options=_JSON_OPTIONS)
+        for ref in record['refs']:
+            ops.setdefault(ref['model'], []).append(ReplaceOne({'_id': ref['doc']['_id']}, ref['doc'], upsert=True))
+        doc = record['doc']
+        ops.setdefault(record['model'], []).append(ReplaceOne({'_id': doc['_id']}, doc, upsert=True))
+
+    counts = {}
+    for model, model_ops in ops.items():
+        odm.dispense(model).collection.bulk_write(model_ops, ordered=False)
+        counts[model] = len(model_ops)
+
+    return counts
+
+
+def _import_batch(job: str, lines: List[str]) -> Dict[str, int]:
+    """Create entities from a batch of records, firing all hooks
+
+    Content entities get new IDs and new route aliases created from exported aliases' strings. Derived fields are
+    recomputed by hooks. Referenced documents, except route aliases, are written directly. Each created entity is
+    recorded in the import map, so entities created before an interruption are skipped while resuming.
+    """
+    records = [json_util.loads(line, json_options=_JSON_OPTIONS) for line in lines]
+    import_map = _import_map()
+    imported = {doc['old_id'] for doc in import_map.find(
+        {'_id': {'$in': ['{}:{}'.format(job, r['doc']['_id']) for r in records]}}, {'old_id': 1})}
+
+    counts = {}
+    for record in records:
+        doc = record['doc']
+        counts[record['model']] = counts.get(record['model'], 0) + 1
+        if str(doc['_id']) in imported:
+            continue
+
+        aliases = {}
+        for ref in record['refs']:
+            if ref['model'] == 'route_alias':
+                aliases[str(ref['doc']['_id'])] = ref['doc'].get('alias')
+            else:
+                odm.dispense(ref['model']).collection.replace_one({'_id': ref['doc']['_id']}, ref['doc'], True)
+
+        try:
+            auth.switch_user_to_system()
+            entity = _api.dispense(record['model'])
+            pending_localizations = []
+            for f_name, value in doc.items():
+                if f_name.startswith('_') or f_name in _SKIP_IMPORT_FIELDS or not entity.has_field(f_name):
+                    continue
+                if f_name.startswith('localization_'):
+                    if _ref_id(value):
+                        pending_localizations.append((f_name, _ref_id(value)))
+                    continue
+                entity.f_set(f_name, value)
+
+            # Route alias is created by entity's hooks from the string, so it points to the new ID
+            alias = aliases.get(_ref_id(doc.get('route_alias')))
+            if alias and entity.has_field('route_alias'):
+                entity.f_set('route_alias', alias)
+
+            entity.save()
+        finally:
+            auth.restore_user()
+
+        import_map.replace_one({'_id': '{}:{}'.format(job, doc['_id'])}, {
+            'job': job,
+            'old_id': str(doc['_id']),
+            'model': record['model'],
+            'eid': entity.id,
+            'localizations': pending_localizations,
+        }, True)
+
+    return counts
+
+
+def _link_localizations(job: str) -> int:
+    """Restore references between imported localizations using new IDs
+
+    Entities are processed in batches, new IDs of referenced localizations are fetched by a single query per batch.
+    References to entities which are not imported are dropped. Returns number of restored references.
+    """
+    import_map = _import_map()
+    projection = {'model': 1, 'eid': 1, 'localizations': 1}
+    cursor = import_map.find({'job': job, 'localizations.0': {'$exists': True}}, projection)
+
+    r = 0
+    try:
+        auth.switch_user_to_system()
+        for docs in _batches(cursor, 1000):
+            old_ids = list({old_id for doc in docs for _, old_id in doc['localizations']})
+            id_map = {m['old_id']: m['eid'] for m in import_map.find({'job': job, 'old_id': {'$in': old_ids}},
+                                                                       {'old_id': 1, 'eid': 1})}
+
+            for doc in docs:
+                for f_name, old_id in doc['localizations']:
+                    if old_id not in id_map:
+                        continue
+
+                    try:
+                        localization = _api.dispense(doc['model'], id_map[old_id])
+                        _api.dispense(doc['model'], doc['eid']).f_set(f_name, localization).save(fast=True)
+                        r += 1
+                    except odm.error.EntityNotFound:
+                        pass
+    finally:
+        auth.restore_user()
+
+    return r
+
+
+def import_(file_path: str, bypass_hooks: bool = False, resume: bool = False, workers: int = None,
+            batch_size: int = None, progress: ProgressCallback = None) -> Dict[str, int]:
+    """Import entities from a file created by `export()`
+
+    If `bypass_hooks` is True, documents are written directly by bulk writes preserving IDs, otherwise entities are
+    created and saved one by one getting new IDs, route aliases and derived fields, and references between
+    localizations are restored after all entities are imported. Returns numbers of imported documents per model.
+
+    Checkpoint holds the number of consumed lines and counts only, old to new IDs map is kept in a collection.
+    """
+    workers = workers or reg.get('content.transfer_workers', 4)
+    batch_size = batch_size or reg.get('content.transfer_batch_size', 500)
+    checkpoint_name = 'import-' + path.basename(file_path)
+    lock = _jobs.FileLock(checkpoint_name)
+    if not lock.acquire():
+        raise RuntimeError("Import of '{}' is already running".format(file_path))
+
+    importer = _import_batch_raw if bypass_hooks else _import_batch
+    opener = gzip.open if file_path.endswith('.gz') else open
+
+    try:
+        checkpoint = _load_checkpoint(checkpoint_name) if resume else {}
+        if checkpoint.get('file_path') != file_path:
+            checkpoint = {'file_path': file_path, 'lines': 0, 'records': 0, 'counts': {}}
+            _import_map().delete_many({'job': checkpoint_name})
+
+        with opener(file_path, 'rt', encoding='utf-8') as f, ThreadPoolExecutor(workers) as executor:
+            # Raw lines are numbered, so the checkpoint refers to a position in the file including blank lines
+            lines = ((n, line) for n, line in enumerate(islice(f, checkpoint['lines'], None), checkpoint['lines'] + 1)
+                     if line.strip())
+            batches = _batches(lines, batch_size)
+            while True:
+                chunk = list(islice(batches, workers))
+                if not chunk:
+                    break
+
+                # Batches are written in parallel, checkpoint is saved after all of them are completed
+                for counts in executor.map(lambda b: importer(checkpoint_name, [i[1] for i in b]), chunk):
+                    for model, count in counts.items():
+                        checkpoint['counts'][model] = checkpoint['counts'].get(model, 0) + count
+
+                checkpoint['lines'] = chunk[-1][-1][0]
+                checkpoint['records'] += sum(len(b) for b in chunk)
+                _save_checkpoint(checkpoint_name, checkpoint)
+                if progress:
+                    progress(checkpoint['records'])
+
+        # Localizations may refer to entities imported later, so they are linked after all entities are imported
+        if not bypass_hooks:
+            _link_localizations(checkpoint_name)
+            _import_map().delete_many({'job': checkpoint_name})
+
+        # Cached entities may be outdated after direct writes
+        if bypass_hooks:
+            for model in checkpoint['counts']:
+                odm.clear_cache(model)
+
+        _remove_checkpoint(checkpoint_name)
+        logger.info("'{}' imported: {}".format(file_path, checkpoint['counts']))
+
+        return checkpoint['counts']
+
+    finally:
+        lock.release()
@@ -23,11 +23,15 @@ class ModelSelect(widget.select.Select):
 
 class ModelCheckboxes(widget.select.Checkboxes):
     """Content Model Checkboxes
+
+    `schema_filter` callable receives `ModelSchema` of a model. `filter` callable receives an entity, which must be
+    dispensed for each model, so `schema_filter` is preferred.
     """
 
     def __init__(self, uid: str, **kwargs):
         self._check_perms = kwargs.get('check_perms', True)
         self._filter = kwargs.get('filter')
+        self._schema_filter = kwargs.get('schema_filter')
 
         items = []
         for model, info in _api.get_models().items():
@@ -35,6 +39,9 @@ class ModelCheckboxes(widget.select.Checkboxes):
 
         items = sorted(items, key=lambda x: x[1])
 
+        if callable(self._schema_filter):
+            items = [item for item in items if self._schema_filter(_api.get_model_schema(item[0]))]
+
         if callable(self._filter):
             filtered_items = []
             for item in items: